@@ -1,9 +1,12 @@
 #!/usr/bin/env python
 import asyncio
 import csv
+import json
 import logging
 import os
+import sqlite3
 import sys
+import time
 
 import meraki.aio
 
@@ -21,6 +24,25 @@ PURPLE = '\033[35m'
 LGRAY = '\033[97m'
 DGRAY = '\033[90m'
 
+PAGE_SIZE = 1000
+SYNC_OVERLAP = 300                  # seconds re-requested before the watermark
+SYNC_MAX_LOOKBACK = 31 * 86400      # getNetworkClients t0 limit
+LOOKBACK_MARGIN = 3600              # keep the clamped t0 this far inside the limit
+FIELDNAMES = ['network', 'device_name', 'switch_port', 'client_mac', 'ip', 'status', 'last_seen']
+
+
+def client_row(net_name, c):
+    return {
+        'network': net_name,
+        'device_name': c['recentDeviceName'],
+        'switch_port': c['switchport'],
+        'client_mac': c['mac'],
+        'ip': c['ip'],
+        'status': c['status'],
+        'last_seen': c['lastSeen'],
+    }
+
+
 def csv_writer(clients):
     csvdir = os.path.join(os.getcwd(), "output")
     if not os.path.exists(csvdir):
@@ -31,23 +53,218 @@ def csv_writer(clients):
     print(f"** Writing {csvfile}")
 
     with open(csvfile, 'w', newline='') as cf:
-        fieldnames = ['network', 'device_name', 'switch_port', 'client_mac', 'ip', 'status', 'last_seen']
-        writer = csv.DictWriter(cf, fieldnames=fieldnames)
+        writer = csv.DictWriter(cf, fieldnames=FIELDNAMES)
         writer.writeheader()
         for name in clients:
             net_name = name
-            clients = clients[name]
 
-            for c in clients:
-                writer.writerow({
-                    'network': net_name,
-                    'device_name': c['recentDeviceName'],
-                    'switch_port': c['switchport'],
-                    'client_mac': c['mac'],
-                    'ip': c['ip'],
-                    'status': c['status'],
-                    'last_seen': c['lastSeen'],
-                })
+            for c in clients[name]:
+                writer.writerow(client_row(net_name, c))
+
+
+class StreamWriter:
+    ''' writes client rows page by page to output/report_<timestamp>.<fmt>.partial,
+        flushing after every page so the partial file is readable mid-crawl,
+        and renames it to the final name on close
+    '''
+    def __init__(self, fmt='csv'):
+        outdir = os.path.join(os.getcwd(), "output")
+        if not os.path.exists(outdir):
+            os.makedirs(outdir)
+
+        self.fmt = fmt
+        self.outfile = f"{outdir}/report_{datetime.now():%Y%m%d-%H%M%S}.{fmt}"
+        self.partfile = f"{self.outfile}.partial"
+        self.rows = 0
+
+        print(f"** Streaming to {self.partfile}")
+        self.fh = open(self.partfile, 'w', newline='')
+        if fmt == 'csv':
+            self.writer = csv.DictWriter(self.fh, fieldnames=FIELDNAMES)
+            self.writer.writeheader()
+        self.fh.flush()
+
+    def write_page(self, net_name, page):
+        for c in page:
+            row = client_row(net_name, c)
+            if self.fmt == 'csv':
+                self.writer.writerow(row)
+            else:
+                self.fh.write(json.dumps(row) + '\n')
+        self.fh.flush()
+        self.rows += len(page)
+
+    def close(self):
+        self.fh.close()
+        os.replace(self.partfile, self.outfile)
+        print(f"** Wrote {self.rows} rows to {self.outfile}")
+
+
+def index_open(path):
+    ''' opens (and creates if needed) the SQLite client index
+    '''
+    indexdir = os.path.dirname(path)
+    if indexdir and not os.path.exists(indexdir):
+        os.makedirs(indexdir)
+
+    con = sqlite3.connect(path)
+    con.row_factory = sqlite3.Row
+    con.executescript('''
+        CREATE TABLE IF NOT EXISTS clients (
+            net_id      TEXT NOT NULL,
+            network     TEXT,
+            client_id   TEXT NOT NULL,
+            mac         TEXT,
+            ip          TEXT,
+            device_name TEXT,
+            switch_port TEXT,
+            status      TEXT,
+            last_seen   TEXT,
+            indexed_at  REAL NOT NULL,
+            PRIMARY KEY (net_id, client_id)
+        );
+        CREATE INDEX IF NOT EXISTS clients_mac ON clients (mac);
+        CREATE INDEX IF NOT EXISTS clients_ip ON clients (ip);
+        CREATE INDEX IF NOT EXISTS clients_network ON clients (network);
+        CREATE INDEX IF NOT EXISTS clients_device_name ON clients (device_name);
+        CREATE INDEX IF NOT EXISTS clients_switch_port ON clients (switch_port);
+        CREATE TABLE IF NOT EXISTS sync_state (
+            net_id      TEXT PRIMARY KEY,
+            last_seen   REAL NOT NULL,
+            synced_at   REAL NOT NULL
+        );
+    ''')
+    return con
+
+
+def index_rows(con, net, clients):
+    ''' upserts one network's clients into the index, keyed by network and client id
+    '''
+    now = time.time()
+    con.executemany(
+        'INSERT OR REPLACE INTO clients VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+        ((net['id'], net['name'], c['id'], (c['mac'] or '').lower(), c['ip'],
+          c['recentDeviceName'], c['switchport'], c['status'], str(c['lastSeen']), now)
+         for c in clients))
+    con.commit()
+
+
+def lastSeenEpoch(last_seen):
+    ''' lastSeen is epoch seconds on older API versions and ISO 8601 on newer ones
+    '''
+    if last_seen is None:
+        return None
+    if isinstance(last_seen, (int, float)) or str(last_seen).isdigit():
+        return float(last_seen)
+    return datetime.fromisoformat(str(last_seen).replace('Z', '+00:00')).timestamp()
+
+
+def index_watermark(con, net_id):
+    row = con.execute('SELECT last_seen FROM sync_state WHERE net_id = ?', (net_id,)).fetchone()
+    return row['last_seen'] if row else None
+
+
+def index_sync(con, net, clients, watermark):
+    ''' merges a delta into the network's snapshot by client id, marks the whole
+        snapshot current and advances the lastSeen watermark
+    '''
+    index_rows(con, net, clients)
+    seen = [lastSeenEpoch(c['lastSeen']) for c in clients if c['lastSeen'] is not None]
+    new_mark = max(seen + ([watermark] if watermark else []), default=time.time())
+    now = time.time()
+    con.execute('UPDATE clients SET indexed_at = ? WHERE net_id = ?', (now, net['id']))
+    con.execute('INSERT OR REPLACE INTO sync_state VALUES (?, ?, ?)', (net['id'], new_mark, now))
+    con.commit()
+
+
+def index_snapshot(con, net_ids):
+    ''' returns {network name: [clients]} from the index in getNetworkClients shape
+    '''
+    snapshot = {}
+    for net_id in net_ids:
+        for r in con.execute('SELECT * FROM clients WHERE net_id = ?', (net_id,)):
+            snapshot.setdefault(r['network'], []).append({
+                'recentDeviceName': r['device_name'],
+                'switchport': r['switch_port'],
+                'mac': r['mac'],
+                'ip': r['ip'],
+                'status': r['status'],
+                'lastSeen': r['last_seen'],
+            })
+    return snapshot
+
+
+def index_query(con, filters):
+    ''' returns index rows matching every column=value in filters, newest first
+    '''
+    where = ' AND '.join(f'{column} = ?' for column in filters)
+    return con.execute(f'SELECT * FROM clients WHERE {where} ORDER BY indexed_at DESC',
+                       tuple(filters.values())).fetchall()
+
+
+def print_index_rows(rows):
+    now = time.time()
+    for r in rows:
+        age = int(now - r['indexed_at'])
+        print(f"{r['network']}, {r['device_name']}, {r['switch_port']}, {r['mac']}, {r['ip']}, "
+              f"{r['status']}, {r['last_seen']} {DGRAY}(indexed {age}s ago){ENDC}")
+
+
+def query(filters):
+    ''' answers from the local index, only going to the API for a MAC that is
+        missing or older than the ttl
+    '''
+    con = index_open(index_path)
+    rows = index_query(con, filters)
+    fresh = [r for r in rows if r['indexed_at'] >= time.time() - ttl]
+
+    if fresh:
+        print_index_rows(fresh)
+    elif 'mac' in filters and (org_name or org_id):
+        print(f"** {YELLOW}{'Stale' if rows else 'No'} index entry, looking up {filters['mac']} live{ENDC}")
+        asyncio.run(liveLookup(con, filters))
+    elif rows:
+        print(f"** {YELLOW}Index entries are older than the ttl, re-crawl with --index to refresh{ENDC}")
+        print_index_rows(rows)
+    else:
+        print(f"** {RED}No match in index{ENDC}")
+    con.close()
+
+
+async def liveLookup(con, filters):
+    async with aiodashboard(iterate=False) as aiodash:
+        try:
+            org = await getOrgs(aiodash, org_name=org_name, org_id=org_id)
+            result = await getOrgClients(aiodash, org['id'], filters['mac'])
+        except meraki.APIError as e:
+            if e.status == 404:
+                print(f"** {RED}Client not found{ENDC}")
+            else:
+                print(f'Meraki API error: {e}')
+            return
+
+        for record in result.get('records', []):
+            net = record['network']
+            client = {'id': result['clientId'], 'mac': result['mac'], 'ip': record.get('ip'),
+                      'recentDeviceName': record.get('recentDeviceName'),
+                      'switchport': record.get('switchport'), 'status': record.get('status'),
+                      'lastSeen': record.get('lastSeen')}
+            index_rows(con, net, [client])
+
+    rows = index_query(con, filters)
+    if rows:
+        print_index_rows(rows)
+    else:
+        print(f"** {RED}Client not found{ENDC}")
+
+
+async def collectPages(result):
+    ''' returns a list from a paged SDK call whether or not the session
+        was built with use_iterator_for_get_pages
+    '''
+    if hasattr(result, '__aiter__'):
+        return [item async for item in result]
+    return await result
 
 
 async def getOrgs(aiodash, org_name=None, org_id=None):
@@ -56,13 +273,13 @@ async def getOrgs(aiodash, org_name=None, org_id=None):
         logger.debug(f"organizations: {CYAN}{result}{ENDC}")
         return result
     elif org_name:
-        organizations = await aiodash.organizations.getOrganizations()
+        organizations = await collectPages(aiodash.organizations.getOrganizations())
         for result in organizations:
             if result['name'] == org_name and result['api']['enabled']:
                 logger.debug(f"organizations: {CYAN}{result}{ENDC}")
                 return result
     else:
-        organizations = await aiodash.organizations.getOrganizations()
+        organizations = await collectPages(aiodash.organizations.getOrganizations())
         result = [ org for org in organizations if org['api']['enabled']]
         logger.debug(f"organizations: {CYAN}{result}{ENDC}")
         return result
@@ -70,9 +287,9 @@ async def getOrgs(aiodash, org_name=None, org_id=None):
 
 async def getNetworks(aiodash, org_id, net_name=None, tag=None):
     product_filter = "systemsManager"
-    networks = await aiodash.organizations.getOrganizationNetworks(org_id,
-                                                             perPage=1000,
-                                                             total_pages='all')
+    networks = await collectPages(aiodash.organizations.getOrganizationNetworks(org_id,
+                                                                             perPage=1000,
+                                                                             total_pages='all'))
 
     if net_name:
         for result in networks:
@@ -95,7 +312,8 @@ async def getTemplates(aiodash, org_id):
 
 
 async def getOrgClients(aiodash, org_id, mac):
-    ''' returns a specific client by mac, no fuzzy search
+    ''' returns a specific client by mac, no fuzzy search; the result is a
+        single record dict, so the session must not use the page iterator
     '''
     clients = await aiodash.organizations.getOrganizationClientsSearch(org_id, mac)
     logger.debug(f'Found {len(clients)} clients')
@@ -106,17 +324,102 @@ async def getOrgClients(aiodash, org_id, mac):
 async def getNetClients(aiodash, net_id, mac=''):
     ''' returns a list of client for a network, allows fuzzy search
     '''
-    clients = await aiodash.networks.getNetworkClients(net_id,
-                                                            mac=mac,
-                                                            perPage=1000,
-                                                            total_pages='all')
+    clients = await collectPages(aiodash.networks.getNetworkClients(net_id,
+                                                                    mac=mac,
+                                                                    perPage=PAGE_SIZE,
+                                                                    total_pages='all'))
     logger.debug(f'Found {len(clients)} clients')
     logger.debug(f'clients: {BOLD}{clients}{ENDC}')
     return clients
 
 
-async def main():
-    async with meraki.aio.AsyncDashboardAPI(
+async def crawlNetClients(aiodash, sem, net, mac=''):
+    ''' wraps getNetClients so no more than `limit` networks are in flight,
+        returns None for the clients when the network fails
+    '''
+    async with sem:
+        try:
+            clients = await getNetClients(aiodash, net['id'], mac=mac)
+        except meraki.APIError as e:
+            print(f"** {RED}{net['name']}: Meraki API error {e.status} {e.message}{ENDC}")
+            clients = None
+        except Exception as e:
+            print(f"** {RED}{net['name']}: SDK Error {e}{ENDC}")
+            clients = None
+    return net, clients
+
+
+async def syncNetClients(aiodash, sem, con, net):
+    ''' requests only clients seen since the network's last sync, or the default
+        timespan when it has never been synced; returns None for the clients
+        when the network fails
+    '''
+    watermark = index_watermark(con, net['id'])
+    kwargs = {}
+    async with sem:
+        # clamped when the call goes out, a queued task may wait a long time for the semaphore
+        if watermark:
+            kwargs['t0'] = max(watermark - SYNC_OVERLAP, time.time() - SYNC_MAX_LOOKBACK + LOOKBACK_MARGIN)
+        try:
+            clients = await collectPages(aiodash.networks.getNetworkClients(net['id'],
+                                                                            perPage=PAGE_SIZE,
+                                                                            total_pages='all',
+                                                                            **kwargs))
+        except meraki.APIError as e:
+            print(f"** {RED}{net['name']}: Meraki API error {e.status} {e.message}{ENDC}")
+            return net, None, watermark
+        except Exception as e:
+            print(f"** {RED}{net['name']}: SDK Error {e}{ENDC}")
+            return net, None, watermark
+    logger.debug(f"{net['name']}: {len(clients)} clients since {kwargs.get('t0')}")
+    return net, clients, watermark
+
+
+async def streamNetClients(aiodash, sem, net, out, index=None, mac=''):
+    ''' iterates a network's clients from the SDK page iterator and hands
+        each page to the stream writer, only one page is held in memory
+    '''
+    count = 0
+    page = []
+    async with sem:
+        try:
+            async for client in aiodash.networks.getNetworkClients(net['id'],
+                                                                   mac=mac,
+                                                                   perPage=PAGE_SIZE,
+                                                                   total_pages='all'):
+                page.append(client)
+                if len(page) == PAGE_SIZE:
+                    flushPage(net, page, out, index)
+                    count += len(page)
+                    page = []
+            if page:
+                flushPage(net, page, out, index)
+                count += len(page)
+        except meraki.APIError as e:
+            print(f"** {RED}{net['name']}: Meraki API error {e.status} {e.message} after {count} clients{ENDC}")
+            return net, None
+        except Exception as e:
+            print(f"** {RED}{net['name']}: SDK Error {e} after {count} clients{ENDC}")
+            return net, None
+    logger.debug(f"{net['name']}: streamed {count} clients")
+    return net, count
+
+
+def flushPage(net, page, out, index=None):
+    if out:
+        out.write_page(net['name'], page)
+    if index:
+        index_rows(index, net, page)
+    if SCREEN_OUTPUT:
+        for c in page:
+            print(', '.join(str(v) for v in client_row(net['name'], c).values()))
+
+
+def aiodashboard(iterate=None):
+    ''' --stream sessions page through iterators, every paged call made on
+        them has to go through collectPages or async for
+    '''
+    return meraki.aio.AsyncDashboardAPI(
         api_key=os.getenv("APIKEY"),
         base_url="https://api.meraki.com/api/v1",
         output_log=output_log,
@@ -124,42 +427,97 @@ async def main():
         log_path=log_path,
         print_console=True,
         inherit_logging_config=False,
-        use_iterator_for_get_pages=False,
+        use_iterator_for_get_pages=STREAM_OUTPUT if iterate is None else iterate,
         suppress_logging=suppress_logging,
         # single_request_timeout=12,
         maximum_concurrent_requests=50,
         maximum_retries=100,
         wait_on_rate_limit=True,
-    ) as aiodash:
+    )
+
+
+async def main():
+    async with aiodashboard() as aiodash:
         print("** Gathering clients")
 
         try:
             org = await getOrgs(aiodash, org_name=org_name, org_id=org_id)
 
-            net_tasks = []
-            net_tasks.append(getNetworks(aiodash, org['id'], net_name=net_name))
-
-            for n in asyncio.as_completed(net_tasks):
-                networks = await n
-                client_dict = {}
-                for net in networks:
-                    print(f"** Checking network: {PURPLE}{net['name']}{ENDC}")
-                    c_tasks = []
-                    check_net = set(products) & set(net['productTypes'])
-                    if check_net:
-                        print(f"** {GREEN}Getting clients{ENDC}")
-                        c_tasks.append(getNetClients(aiodash, net['id'], mac=mac))
-                    else:
-                        print(f"** {YELLOW}Network does not include product type{ENDC}")
-
-                    for c in asyncio.as_completed(c_tasks):
-                        clients = await c
-                        if len(clients) > 0:
-                            client_dict[net['name']] = clients
-                        else:
-                            print(f"** {RED}No Clients in network {net['name']}{ENDC}")
-            
-            if SCREEN_OUTPUT:
+            networks = await getNetworks(aiodash, org['id'], net_name=net_name)
+            if isinstance(networks, dict):
+                networks = [networks]
+
+            client_dict = {}
+            c_tasks = []
+            sem = asyncio.Semaphore(limit)
+            out = None
+            if STREAM_OUTPUT and WRITE_CSV:
+                out = StreamWriter(fmt=out_format)
+            index = index_open(index_path) if WRITE_INDEX or SYNC_MODE else None
+            synced = []
+            for net in networks:
+                check_net = set(products) & set(net['productTypes'])
+                if check_net and SYNC_MODE:
+                    c_tasks.append(syncNetClients(aiodash, sem, index, net))
+                elif check_net and STREAM_OUTPUT:
+                    c_tasks.append(streamNetClients(aiodash, sem, net, out, index=index, mac=mac))
+                elif check_net:
+                    c_tasks.append(crawlNetClients(aiodash, sem, net, mac=mac))
+                else:
+                    logger.info(f"{net['name']}: network does not include product type")
+
+            print(f"** {GREEN}Getting clients{ENDC} for {len(c_tasks)} networks, {limit} in flight")
+            crawl_start = time.monotonic()
+            net_count = 0
+            client_count = 0
+            failed = 0
+            for c in asyncio.as_completed(c_tasks):
+                if SYNC_MODE:
+                    net, clients, watermark = await c
+                    if clients is None:
+                        # watermark stays put so the next sync retries the whole gap
+                        failed += 1
+                        continue
+                    index_sync(index, net, clients, watermark)
+                    synced.append(net['id'])
+                    net_count += 1
+                    client_count += len(clients)
+                    print(f"** [{net_count}/{len(c_tasks)}] {PURPLE}{net['name']}{ENDC}: "
+                          f"{len(clients)} clients {'since last sync' if watermark else '(initial sync)'}")
+                    continue
+
+                net, clients = await c
+                if clients is None:
+                    failed += 1
+                    continue
+                found = clients if STREAM_OUTPUT else len(clients)
+                net_count += 1
+                client_count += found
+                if found > 0:
+                    print(f"** [{net_count}/{len(c_tasks)}] {PURPLE}{net['name']}{ENDC}: {found} clients")
+                    if not STREAM_OUTPUT:
+                        client_dict[net['name']] = clients
+                        if index:
+                            index_rows(index, net, clients)
+                else:
+                    print(f"** [{net_count}/{len(c_tasks)}] {RED}No Clients in network {net['name']}{ENDC}")
+            crawl_time = time.monotonic() - crawl_start
+
+            print(f"** Crawled {net_count} networks, {client_count} clients in {crawl_time:.1f}s "
+                  f"({net_count / max(crawl_time, 0.001):.1f} networks/sec, "
+                  f"{client_count / max(crawl_time, 0.001):.1f} clients/sec)")
+            if failed:
+                print(f"** {RED}{failed} networks failed, their clients are missing{ENDC}")
+
+            if out:
+                out.close()
+            if SYNC_MODE:
+                client_dict = index_snapshot(index, synced)
+            if index:
+                index.close()
+                print(f"** Indexed clients in {index_path}")
+
+            if SCREEN_OUTPUT and not STREAM_OUTPUT:
                 print()
                 for name in client_dict:
                     network = name
@@ -174,7 +532,7 @@ async def main():
                         
                         print(f"{network}, {device_name}, {switch_port}, {client_mac}, {ip}, {status}, {last_seen}")
 
-            if WRITE_CSV:
+            if WRITE_CSV and not STREAM_OUTPUT:
                 if len(client_dict) > 0:
                     csv_writer(client_dict)
                 else:
@@ -211,10 +569,39 @@ if __name__ == '__main__':
                         help = "Meraki device type")
     parser.add_argument("--mac", type = str,
                         help = "MAC address to search"),
+    parser.add_argument("--limit", type = int,
+                        default=20,
+                        help = "Maximum networks crawled concurrently (Default: 20)")
     parser.add_argument("--noout", action = "store_true",
                         help = "Turn off terminal output of client list")
     parser.add_argument("--csv", action = "store_true",
                         help = "Write CSV file")
+    parser.add_argument("--stream", action = "store_true",
+                        help = "Write each page of clients as it arrives instead of holding all clients in memory")
+    parser.add_argument("--format", type = str,
+                        default='csv',
+                        choices=['csv', 'ndjson'],
+                        help = "Output file format with --stream (Default: csv)")
+    parser.add_argument("--index", action = "store_true",
+                        help = "Store crawled clients in the local SQLite index")
+    parser.add_argument("--sync", action = "store_true",
+                        help = "Incremental sync: fetch only clients seen since each network's last sync "
+                               "and merge them into the index snapshot")
+    parser.add_argument("--query", action = "store_true",
+                        help = "Answer from the local index by --mac, --ip, --device, --port and/or -n, "
+                               "a stale or missing --mac falls back to a live lookup")
+    parser.add_argument("--ip", type = str,
+                        help = "Client IP address to query in the index")
+    parser.add_argument("--device", type = str,
+                        help = "Recent device name to query in the index")
+    parser.add_argument("--port", type = str,
+                        help = "Switch port to query in the index")
+    parser.add_argument("--ttl", type = float,
+                        default=24,
+                        help = "Hours before an index entry is considered stale (Default: 24)")
+    parser.add_argument("--db", type = str,
+                        default=os.path.join("index", "clients.db"),
+                        help = "Client index path (Default: index/clients.db)")
     parser.add_argument("--log", action = "store_true",
                         help = 'Log to file')
     parser.add_argument("-v", action = "store_true",
@@ -249,6 +636,12 @@ if __name__ == '__main__':
 
     products = args.type
 
+    if args.limit < 1:
+        print('--limit must be at least 1')
+        sys.exit()
+    else:
+        limit = args.limit
+
     if args.mac:
         mac = args.mac
     else:
@@ -264,6 +657,34 @@ if __name__ == '__main__':
     else:
         WRITE_CSV = False
 
+    if args.stream:
+        STREAM_OUTPUT = True
+    else:
+        STREAM_OUTPUT = False
+
+    if args.index:
+        WRITE_INDEX = True
+    else:
+        WRITE_INDEX = False
+
+    if args.sync:
+        SYNC_MODE = True
+    else:
+        SYNC_MODE = False
+
+    if args.sync and (args.stream or args.mac):
+        print('--sync cannot be combined with --stream or --mac')
+        sys.exit()
+
+    index_path = args.db
+    ttl = args.ttl * 3600
+
+    if args.format != 'csv' and not args.stream:
+        print('--format requires --stream')
+        sys.exit()
+    else:
+        out_format = args.format
+
     log_path = os.path.join(os.getcwd(), "log")
     if not os.path.exists(log_path):
         os.makedirs(log_path)
@@ -278,9 +699,12 @@ if __name__ == '__main__':
         suppress_logging = True
         output_log = False
 
-    if not (args.o or args.i):
+    if not (args.o or args.i or args.query):
         print('Specify an organization name or id for operation')
         sys.exit()
+    elif not (args.o or args.i):
+        org_name = None
+        org_id = None
     else:
         if args.o:
             org_name = args.o
@@ -299,7 +723,24 @@ if __name__ == '__main__':
     if args.t:
         net_tag = args.t
 
-    # main()
-    asyncio.run(main())
+    if args.query:
+        filters = {}
+        if args.mac:
+            filters['mac'] = args.mac.lower().replace('-', ':')
+        if args.ip:
+            filters['ip'] = args.ip
+        if args.device:
+            filters['device_name'] = args.device
+        if args.port:
+            filters['switch_port'] = args.port
+        if args.n:
+            filters['network'] = args.n
+        if not filters:
+            print('--query needs at least one of --mac, --ip, --device, --port or -n')
+            sys.exit()
+        query(filters)
+    else:
+        # main()
+        asyncio.run(main())
     end_time = datetime.now()
     print(f'\nScript complete, total runtime {end_time - start_time}')
@@ -1,14 +1,26 @@
 #!/usr/bin/env python
+import asyncio
+import hashlib
+import json
 import logging
 import os
+import re
 import sys
 from datetime import datetime
 
 import meraki
+import meraki.aio
 from argparse import ArgumentParser
 
 ALLOWLIST = "filterlists/allowlist.txt"
 BLOCKLIST = "filterlists/blocklist.txt"
+LISTCACHE = "filterlists/.cache"
+
+# Dashboard limits for the allowed/blocked URL pattern lists
+MAX_PATTERNS = 1000
+MAX_PATTERN_LENGTH = 255
+
+COMPILER_VERSION = 2
 
 BOLD = '\033[1m'
 ENDC = '\033[0m'
@@ -71,14 +83,191 @@ def readBlockList():
         return []
 
 
-def compareList(listA, listB):
-    # check to see if a site is in both the allow and block lists
-    match = set(listA) & set(listB)
-    if match:
-        print('Allow and Block lists both have identical element, exiting:')
-        for m in match:
-            print(m)
+def patternSet(patterns):
+    return {p.strip() for p in patterns or [] if p.strip()}
+
+
+def filterMatches(current, allowlist, blocklist, blockcategory=None):
+    ''' True when the network already has the desired patterns (and categories,
+        if any were given), ignoring order and duplicates
+    '''
+    if patternSet(current.get('allowedUrlPatterns')) != patternSet(allowlist):
+        return False
+    if patternSet(current.get('blockedUrlPatterns')) != patternSet(blocklist):
+        return False
+    if blockcategory is not None:
+        categories = {c['id'] if isinstance(c, dict) else c for c in current.get('blockedUrlCategories') or []}
+        if categories != set(blockcategory):
+            return False
+    return True
+
+
+async def aGetContentFilter(aiodash, net_id):
+    filter = await aiodash.appliance.getNetworkApplianceContentFiltering(net_id)
+    logging.debug(f'filter: {BOLD}{filter}{ENDC}')
+    return filter
+
+
+async def aSetContentFilter(aiodash, net_id, allowlist=None, blocklist=None, listsize='fullList'):
+    response = await aiodash.appliance.updateNetworkApplianceContentFiltering(
+        net_id,
+        allowedUrlPatterns=allowlist,
+        blockedUrlPatterns=blocklist,
+        urlCategoryListSize=listsize
+    )
+    return response
+
+
+async def aReconcileFilter(aiodash, sem, network, allowlist, blocklist):
+    ''' reads the network's filter and writes it only if it differs,
+        returns 'changed', 'unchanged' or 'failed'
+    '''
+    async with sem:
+        try:
+            filter = await aGetContentFilter(aiodash, network["id"])
+            if not force and filterMatches(filter, allowlist, blocklist):
+                return network, 'unchanged'
+            await aSetContentFilter(aiodash, network["id"], allowlist, blocklist)
+            return network, 'changed'
+        except meraki.APIError as e:
+            print(f'Meraki API error on {network["name"]}: {e}')
+            return network, 'failed'
+        except Exception as e:
+            print(f'SDK Error on {network["name"]}: {e}')
+            return network, 'failed'
+
+
+def normalizePattern(pattern):
+    ''' strips scheme, lower cases the host and drops trailing slashes,
+        returns None for blank lines and comments
+    '''
+    p = pattern.strip()
+    if not p or p.startswith('#'):
+        return None
+    p = re.sub(r'^[a-z][a-z0-9+.-]*://', '', p, flags=re.I)
+    host, _, path = p.partition('/')
+    host = host.lower().rstrip('.')
+    path = path.rstrip('/')
+    return f'{host}/{path}' if path else host
+
+
+def dedupe(patterns):
+    result = {}
+    for pattern in patterns:
+        p = normalizePattern(pattern)
+        if p:
+            result[p] = True
+    return list(result)
+
+
+def patternKey(pattern):
+    ''' returns (reversed host labels, wildcard, has path) for the trie
+    '''
+    host, _, path = pattern.partition('/')
+    wild = host.startswith('*.')
+    if wild:
+        host = host[2:]
+    return host.split('.')[::-1], wild, bool(path)
+
+
+def findConflicts(allowlist, blocklist):
+    ''' builds a reversed-domain trie of the host-only entries of both lists,
+        then walks each pattern's labels once to find the entries that cover it:
+        a domain covers itself, its subdomains and their paths, a wildcard only
+        its subdomains; entries with a path never cover anything
+    '''
+    lists = {'allow': allowlist, 'block': blocklist}
+    trie = {}
+    for name, patterns in lists.items():
+        for pattern in patterns:
+            labels, wild, path = patternKey(pattern)
+            if path:
+                continue
+            node = trie
+            for label in labels:
+                node = node.setdefault(label, {})
+            node.setdefault('', []).append((name, pattern, wild))
+
+    conflicts = {'identical': [], 'allowed under blocked domain': [],
+                 'block overridden by allow': [], 'shadowed': [], 'too long': []}
+    for name, patterns in lists.items():
+        for pattern in patterns:
+            if len(pattern) > MAX_PATTERN_LENGTH:
+                conflicts['too long'].append(f'{name}: {pattern}')
+
+            labels, wild, path = patternKey(pattern)
+            node = trie
+            for depth, label in enumerate(labels):
+                node = node.get(label)
+                if node is None:
+                    break
+                last = depth == len(labels) - 1
+                for other, cover, cover_wild in node.get('', []):
+                    if cover == pattern:
+                        continue
+                    # same host: *.example.net does not cover example.net itself
+                    if last and cover_wild and not wild:
+                        continue
+                    if other == name:
+                        conflicts['shadowed'].append(f'{name}: {pattern} covered by {cover}')
+                    elif name == 'allow':
+                        conflicts['allowed under blocked domain'].append(f'{pattern} under {cover}')
+                    else:
+                        conflicts['block overridden by allow'].append(f'{pattern} by {cover}')
+
+    for pattern in set(allowlist) & set(blocklist):
+        conflicts['identical'].append(pattern)
+    for name, patterns in lists.items():
+        if len(patterns) > MAX_PATTERNS:
+            conflicts['too long'].append(f'{name} list has {len(patterns)} entries, limit is {MAX_PATTERNS}')
+    return conflicts
+
+
+def compileLists(allowlist, blocklist):
+    ''' normalizes, dedupes and checks both lists, the result is cached by
+        content hash so unchanged lists are not recompiled
+    '''
+    digest = hashlib.sha256(json.dumps([COMPILER_VERSION, allowlist, blocklist]).encode()).hexdigest()
+    cachefile = os.path.join(LISTCACHE, f'{digest}.json')
+    if os.path.exists(cachefile):
+        logging.info(f'Using compiled lists {cachefile}')
+        with open(cachefile, 'r') as cf:
+            return json.load(cf)
+
+    allowlist = dedupe(allowlist)
+    blocklist = dedupe(blocklist)
+    compiled = {'allow': allowlist, 'block': blocklist,
+                'conflicts': findConflicts(allowlist, blocklist)}
+
+    if not os.path.exists(LISTCACHE):
+        os.makedirs(LISTCACHE)
+    with open(cachefile, 'w') as cf:
+        json.dump(compiled, cf)
+    return compiled
+
+
+def loadLists():
+    ''' reads and compiles the allow and block lists once per run, exits if a
+        pattern is in both lists
+    '''
+    compiled = compileLists(readAllowList(), readBlockList())
+    print(f'Allow list: {len(compiled["allow"])} patterns, Block list: {len(compiled["block"])} patterns')
+
+    for kind, found in compiled['conflicts'].items():
+        if not found:
+            continue
+        print(f'{BOLD}{len(found)} {kind}{ENDC}')
+        for f in found[:10]:
+            print(f'  {f}')
+        if len(found) > 10:
+            print(f'  ... {len(found) - 10} more')
+        for f in found[10:]:
+            logging.info(f'{kind}: {f}')
+
+    if compiled['conflicts']['identical']:
+        print('Allow and Block lists both have identical element, exiting')
         sys.exit()
+    return compiled['allow'], compiled['block']
 
 
 def main():
@@ -94,6 +283,13 @@ def main():
 
     orgs = getOrganizations(dashboard)
 
+    if clear_filter:
+        print('Clearing Content Filter for targets')
+        allowlist = []
+        blocklist = []
+    else:
+        allowlist, blocklist = loadLists()
+
     control = (org for org in orgs if org["name"] == target_org)
     for org in control:
         if org["api"]["enabled"] == False:
@@ -102,26 +298,6 @@ def main():
 
         try:
             networks = getNetworks(dashboard, org["id"])
-            for network in networks:
-                print(f'Network: {network["name"]}')
-                filter = getContentFilter(dashboard, network["id"])
-
-                if net_tag in network["tags"]:
-                    if clear_filter:
-                        print('Clearing Content Filter for targets')
-                        allowlist = []
-                        blocklist = []
-                    else:
-                        print('Matched filter tag, applying filter')
-                        allowlist = readAllowList()
-                        blocklist = readBlockList()
-                        compareList(allowlist, blocklist)
-    
-                    # TODO: we should check if filter matches before we 
-                    # go ahead and set it again lets not waste API calls
-                    
-                    setfilter = setContentFilter(dashboard, network["id"], allowlist, blocklist)
-
         except meraki.APIError as e:
             print(f'Meraki API error: {e}')
             print(f'Status code = {e.status}')
@@ -132,6 +308,88 @@ def main():
             print(f'SDK Error: {e}')
             continue
 
+        changed = unchanged = failed = 0
+        for network in networks:
+            if net_tag not in network["tags"]:
+                continue
+
+            print(f'Network: {network["name"]}')
+            try:
+                filter = getContentFilter(dashboard, network["id"])
+                if not force and filterMatches(filter, allowlist, blocklist):
+                    print('Content Filter already matches, skipping')
+                    unchanged += 1
+                    continue
+
+                setfilter = setContentFilter(dashboard, network["id"], allowlist, blocklist)
+                changed += 1
+
+            except meraki.APIError as e:
+                print(f'Meraki API error: {e}')
+                print(f'Status code = {e.status}')
+                print(f'Reason = {e.reason}')
+                print(f'Error = {e.message}')
+                failed += 1
+            except Exception as e:
+                print(f'SDK Error: {e}')
+                failed += 1
+
+        print(f'\n{BOLD}{changed} changed, {unchanged} unchanged, {failed} failed{ENDC}')
+
+async def aiomain():
+    async with meraki.aio.AsyncDashboardAPI(
+        api_key=os.getenv('APIKEY'),
+        base_url='https://api.meraki.com/api/v1/',
+        output_log=False,
+        log_file_prefix=os.path.basename(__file__)[:-3],
+        log_path='',
+        print_console=False,
+        inherit_logging_config=True,
+        maximum_concurrent_requests=limit,
+        maximum_retries=100,
+        wait_on_rate_limit=True,
+    ) as aiodash:
+        orgs = await aiodash.organizations.getOrganizations()
+        print(f'Found {len(orgs)} organizations.')
+
+        if clear_filter:
+            print('Clearing Content Filter for targets')
+            allowlist = []
+            blocklist = []
+        else:
+            allowlist, blocklist = loadLists()
+
+        control = (org for org in orgs if org["name"] == target_org)
+        for org in control:
+            if org["api"]["enabled"] == False:
+                continue
+            print(f'Analyzing organization {org["name"]}:')
+
+            try:
+                networks = await aiodash.organizations.getOrganizationNetworks(org["id"],
+                                                                               perPage=1000,
+                                                                               total_pages='all')
+            except meraki.APIError as e:
+                print(f'Meraki API error: {e}')
+                continue
+
+            targets = [network for network in networks
+                       if net_tag in network["tags"] and 'appliance' in network["productTypes"]]
+            print(f'Found {len(networks)} networks, {len(targets)} tagged {net_tag} with an appliance.')
+
+            sem = asyncio.Semaphore(limit)
+            tasks = [aReconcileFilter(aiodash, sem, network, allowlist, blocklist) for network in targets]
+
+            results = {'changed': 0, 'unchanged': 0, 'failed': 0}
+            for task in asyncio.as_completed(tasks):
+                network, status = await task
+                results[status] += 1
+                print(f'Network: {network["name"]} {status}')
+
+            print(f'\n{BOLD}{results["changed"]} changed, {results["unchanged"]} unchanged, '
+                  f'{results["failed"]} failed{ENDC}')
+
+
 if __name__ == '__main__':
     parser = ArgumentParser(description = 'Select options.')
 
@@ -143,6 +401,15 @@ if __name__ == '__main__':
                         help = 'Tag name for operation (one tag only)')
     parser.add_argument('-c', action = 'store_true',
                         help = 'Clear ContentFilter for targets')
+    parser.add_argument('-f', action = 'store_true',
+                        help = 'Force update even if the Content Filter already matches')
+    parser.add_argument('-k', action = 'store_true',
+                        help = 'Check the allow and block lists only, no API calls')
+    parser.add_argument('-a', action = 'store_true',
+                        help = 'Run reads and writes concurrently with the async client')
+    parser.add_argument('-l', type = int,
+                        default=10,
+                        help = 'Concurrent networks with -a (Default: 10)')
     parser.add_argument('-v', action = 'store_true',
                         help = 'verbose')
     parser.add_argument('-d', action = 'store_true',
@@ -154,6 +421,7 @@ if __name__ == '__main__':
     target_network = None
     net_tag = None
     clear_filter = False
+    force = False
 
     if args.v:
         print_console = True
@@ -165,6 +433,10 @@ if __name__ == '__main__':
         logging.basicConfig(level=logging.DEBUG,
                         format="%(asctime)s - %(levelname)s - %(message)s")
 
+    if args.k:
+        loadLists()
+        sys.exit()
+
     if not args.o:
         print('Specify an organization for operation')
         sys.exit()
@@ -180,7 +452,19 @@ if __name__ == '__main__':
     if args.c:
         clear_filter = True
 
+    if args.f:
+        force = True
+
+    if args.l < 1:
+        print('Concurrency (-l) must be at least 1')
+        sys.exit()
+    else:
+        limit = args.l
+
     start_time = datetime.now()
-    main()
+    if args.a:
+        asyncio.run(aiomain())
+    else:
+        main()
     end_time = datetime.now()
     print(f'\nScript complete, total runtime {end_time - start_time}')
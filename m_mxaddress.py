@@ -1,7 +1,11 @@
 #!/usr/bin/env python
+import asyncio
+import csv
+import heapq
 import ipaddress
 import logging
 import meraki
+import meraki.aio
 import os
 import sys
 
@@ -11,6 +15,15 @@ from datetime import datetime
 BOLD = '\033[1m'
 ENDC = '\033[0m'
 
+# override to point at a local stand-in for testing
+BASE_URL = os.getenv('MERAKI_BASE_URL', 'https://api.meraki.com/api/v1/')
+
+ACTION_BATCH_SIZE = 100         # max actions in an asynchronous action batch
+ACTION_BATCH_CONCURRENCY = 5    # max running action batches per organization
+ACTION_BATCH_POLL = 2           # seconds between action batch status checks
+PLAN_CONCURRENCY = 10           # networks updated at once when applying a plan
+PLAN_FIELDS = ['network', 'vlanId', 'applianceIp', 'subnet']
+
 def getOrganizations(dashboard):
     organizations = dashboard.organizations.getOrganizations()
     logging.info(f'Found {len(organizations)} organizations.')
@@ -19,18 +32,12 @@ def getOrganizations(dashboard):
 
 
 def getNetworks(dashboard, orgId):
-    networks = dashboard.organizations.getOrganizationNetworks(orgId)
+    networks = dashboard.organizations.getOrganizationNetworks(orgId, perPage=1000, total_pages='all')
     logging.info(f'Found {len(networks)} networks.')
     logging.debug(f'networks: {BOLD}{networks}{ENDC}')
     return networks
 
 
-def getNetwork(dashboard, netId):
-    network = dashboard.networks.getNetwork(netId)
-    logging.info(network)
-    return network
-
-
 def getOrgTemplates(dashboard, orgId):
     templates = dashboard.organizations.getOrganizationConfigTemplates(orgId)
     logging.info(templates)
@@ -49,12 +56,30 @@ def getNetworkApplianceVlans(dashboard, templateId):
     return applianceVlans
 
 
-def getSpoke(dashboard, nId):
-    devices = dashboard.networks.getNetworkDevices(nId)
-    logging.info(devices)
+def getOrgAppliances(dashboard, orgId, networkIds=None):
+    kwargs = {'networkIds': networkIds} if networkIds else {}
+    devices = dashboard.organizations.getOrganizationDevices(orgId,
+                                                            productTypes=['appliance'],
+                                                            perPage=1000,
+                                                            total_pages='all',
+                                                            **kwargs)
+    logging.info(f'Found {len(devices)} appliances.')
+    logging.debug(f'appliances: {BOLD}{devices}{ENDC}')
     return devices
 
 
+def applianceIndex(networks, devices):
+    ''' indexes networks by id with their template and appliances, an HA pair
+        lists both appliances
+    '''
+    index = {n['id']: {'network': n, 'templateId': n.get('configTemplateId'), 'appliances': []}
+             for n in networks}
+    for device in sorted(devices, key=lambda d: d['serial']):
+        if device.get('networkId') in index:
+            index[device['networkId']]['appliances'].append(device)
+    return index
+
+
 def getSubnets(dashboard, nId):
     subnets = dashboard.appliance.getNetworkApplianceVlans(nId)
     logging.info(subnets)
@@ -71,6 +96,81 @@ def updateSubnets(dashboard, nId, vlanId, mxIp, mxSubnet):
     return response
 
 
+async def aRunActionBatch(aiodash, sem, orgId, actions):
+    ''' submits one confirmed asynchronous action batch and polls it until it
+        completes or fails
+    '''
+    async with sem:
+        batch = await aiodash.organizations.createOrganizationActionBatch(orgId,
+                                                                        actions,
+                                                                        confirmed=True,
+                                                                        synchronous=False)
+        while not (batch['status']['completed'] or batch['status']['failed']):
+            await asyncio.sleep(ACTION_BATCH_POLL)
+            batch = await aiodash.organizations.getOrganizationActionBatch(orgId, batch['id'])
+    logging.info(f"action batch {batch['id']}: {batch['status']}")
+    return batch
+
+
+def aiodashboard():
+    return meraki.aio.AsyncDashboardAPI(
+        api_key=os.getenv('APIKEY'),
+        base_url=BASE_URL,
+        output_log=False,
+        log_file_prefix=os.path.basename(__file__)[:-3],
+        log_path='',
+        print_console=False,
+        inherit_logging_config=True,
+        maximum_retries=100,
+        wait_on_rate_limit=True,
+    )
+
+
+async def aiobatch(orgId, actions, labels):
+    ''' runs actions as action batches of up to ACTION_BATCH_SIZE, returns
+        (label, ok, errors) per action; a batch is atomic so a failed batch
+        reports its errors against every action it carried
+    '''
+    async with aiodashboard() as aiodash:
+        sem = asyncio.Semaphore(ACTION_BATCH_CONCURRENCY)
+        chunks = [range(i, min(i + ACTION_BATCH_SIZE, len(actions)))
+                  for i in range(0, len(actions), ACTION_BATCH_SIZE)]
+        print(f"Submitting {len(actions)} actions in {len(chunks)} action batches")
+        batches = await asyncio.gather(*[aRunActionBatch(aiodash, sem, orgId, [actions[i] for i in chunk])
+                                         for chunk in chunks],
+                                       return_exceptions=True)
+
+    results = []
+    for chunk, batch in zip(chunks, batches):
+        if isinstance(batch, Exception):
+            errors = [str(batch)]
+        else:
+            errors = batch['status']['errors'] if batch['status']['failed'] else []
+        for i in chunk:
+            results.append((labels[i], not errors, errors))
+    return results
+
+
+def vlanAction(dashboard, nId, vlanId, mxIp, mxSubnet):
+    return dashboard.batch.appliance.updateNetworkApplianceVlan(
+            nId,
+            vlanId,
+            subnet=mxSubnet,
+            applianceIp=mxIp
+        )
+
+
+def printBatchResults(results):
+    failed = 0
+    for label, ok, errors in results:
+        if ok:
+            print(f"{label}: updated")
+        else:
+            failed += 1
+            print(f"{BOLD}{label}: failed{ENDC} {'; '.join(errors)}")
+    print(f"\n{len(results) - failed} updated, {failed} failed")
+
+
 def ipInSubnet(ip, subnet):
     if ipaddress.ip_address(ip) in ipaddress.ip_network(subnet):
         return True
@@ -111,10 +211,431 @@ def subnetInCidr(subnet, cidr):
         return False
 
 
+def readPlan(path):
+    ''' reads plan rows of network, vlanId, applianceIp, subnet from a CSV
+        file, or a YAML list of mappings when the file ends in .yml/.yaml
+    '''
+    with open(path, 'r', newline='') as pf:
+        if path.endswith(('.yml', '.yaml')):
+            try:
+                import yaml
+            except ImportError:
+                print("YAML plans need PyYAML (pip install pyyaml), or use a CSV plan")
+                sys.exit()
+            rows = yaml.safe_load(pf) or []
+        else:
+            rows = list(csv.DictReader(pf))
+
+    plan = []
+    for row in rows:
+        plan.append({f: str(row.get(f, '') or '').strip() for f in PLAN_FIELDS})
+    print(f"Read {len(plan)} plan rows from {path}")
+    return plan
+
+
+def validateRow(row, networkIndex, templateVlans):
+    ''' returns (network, error) for a plan row, error is None when the row
+        passes the same checks as the interactive re-write
+    '''
+    network = networkIndex.get(row['network'])
+    if not network:
+        return None, "network not found"
+    templateId = network.get('configTemplateId')
+    if not templateId:
+        return network, "network is not bound to a template"
+    tVlan = templateVlans[templateId].get(row['vlanId'])
+    if not tVlan:
+        return network, f"VLAN {row['vlanId']} not in template"
+
+    # an IPv6 or malformed value raises from ipaddress, that only fails the row
+    try:
+        cidr = ipaddress.ip_network(tVlan['cidr'])
+        mask = int(tVlan['mask'])
+        if not (testIp(row['applianceIp']) and ipInSubnet(row['applianceIp'], cidr)):
+            return network, f"applianceIp must be valid and in {cidr}"
+        if not (testSubnet(row['subnet']) and subnetInCidr(row['subnet'], cidr)):
+            return network, f"subnet must be valid and in {cidr}"
+        if ipaddress.ip_network(row['subnet']).prefixlen != mask:
+            return network, f"subnet must be a /{mask}"
+        if ipaddress.ip_address(row['applianceIp']) not in ipaddress.ip_network(row['subnet']):
+            return network, "applianceIp not in subnet"
+    except (ValueError, TypeError) as e:
+        return network, f"invalid address: {e}"
+    return network, None
+
+
+async def aApplyNetwork(aiodash, sem, network, rows):
+    ''' applies one network's rows in order, returns (row, ok, error) per row
+    '''
+    results = []
+    async with sem:
+        for row in rows:
+            try:
+                await aiodash.appliance.updateNetworkApplianceVlan(network['id'],
+                                                                   row['vlanId'],
+                                                                   subnet=row['subnet'],
+                                                                   applianceIp=row['applianceIp'])
+                results.append((row, True, ''))
+            except meraki.APIError as e:
+                results.append((row, False, f"{e.status} {e.message}"))
+    return results
+
+
+async def aioapply(byNetwork):
+    async with aiodashboard() as aiodash:
+        sem = asyncio.Semaphore(PLAN_CONCURRENCY)
+        tasks = [aApplyNetwork(aiodash, sem, byNetwork[nId]['network'], byNetwork[nId]['rows'])
+                 for nId in byNetwork]
+        results = []
+        for task in asyncio.as_completed(tasks):
+            results.extend(await task)
+        return results
+
+
+def planReport(report):
+    logdir = "report"
+    if not os.path.exists(logdir):
+        print("Creating report directory")
+        os.makedirs(logdir)
+
+    csvfile = f"{logdir}/plan_{datetime.now():%Y%m%d-%H%M%S}.csv"
+    print(f"Writing {csvfile}")
+
+    with open(csvfile, 'w', newline='') as cf:
+        writer = csv.DictWriter(cf, fieldnames=PLAN_FIELDS + ['result', 'detail'])
+        writer.writeheader()
+        for row, result, detail in report:
+            writer.writerow({**row, 'result': result, 'detail': detail})
+
+    counts = {}
+    for _, result, _ in report:
+        counts[result] = counts.get(result, 0) + 1
+    print(', '.join(f"{counts[r]} {r}" for r in counts))
+
+
+def applyPlan(dashboard, orgId, plan):
+    ''' validates every row up front, then applies the valid rows concurrently
+        across networks, directly or as action batches with -b
+    '''
+    networks = getNetworks(dashboard, orgId)
+    networkIndex = {}
+    for network in networks:
+        networkIndex[network['name']] = network
+        networkIndex[network['id']] = network
+
+    templateVlans = {}
+    for row in plan:
+        network = networkIndex.get(row['network'])
+        templateId = network.get('configTemplateId') if network else None
+        if templateId and templateId not in templateVlans:
+            templateVlans[templateId] = {str(tv['id']): tv for tv in getNetworkApplianceVlans(dashboard, templateId)}
+
+    report = []
+    byNetwork = {}
+    for row in plan:
+        network, error = validateRow(row, networkIndex, templateVlans)
+        if error:
+            print(f"{BOLD}{row['network']} VLAN {row['vlanId']}: invalid{ENDC} {error}")
+            report.append((row, 'invalid', error))
+        else:
+            byNetwork.setdefault(network['id'], {'network': network, 'rows': []})['rows'].append(row)
+
+    valid = sum(len(n['rows']) for n in byNetwork.values())
+    print(f"{valid} valid rows across {len(byNetwork)} networks, {len(report)} invalid")
+
+    if batch:
+        rows = [row for n in byNetwork.values() for row in n['rows']]
+        actions = [vlanAction(dashboard, n['network']['id'], row['vlanId'], row['applianceIp'], row['subnet'])
+                   for n in byNetwork.values() for row in n['rows']]
+        results = asyncio.run(aiobatch(orgId, actions, list(range(len(rows))))) if actions else []
+        results = [(rows[i], ok, '; '.join(errors)) for i, ok, errors in results]
+    else:
+        results = asyncio.run(aioapply(byNetwork)) if byNetwork else []
+
+    for row, ok, detail in results:
+        print(f"{row['network']} VLAN {row['vlanId']}: {'updated' if ok else 'failed'} {detail}")
+        report.append((row, 'updated' if ok else 'failed', detail))
+
+    planReport(report)
+
+
+def ipToInt(ip):
+    a, b, c, d = ip.split('.')
+    return (int(a) << 24) | (int(b) << 16) | (int(c) << 8) | int(d)
+
+
+def intToIp(n):
+    return f"{n >> 24 & 255}.{n >> 16 & 255}.{n >> 8 & 255}.{n & 255}"
+
+
+def cidrRange(cidr):
+    ''' returns the (first, last) integer addresses of an IPv4 cidr
+    '''
+    ip, _, bits = cidr.partition('/')
+    size = 1 << (32 - int(bits))
+    first = ipToInt(ip) & ~(size - 1)
+    return first, first + size - 1
+
+
+def mergeRanges(ranges):
+    ''' sorts and merges overlapping or adjacent (first, last) ranges
+    '''
+    merged = []
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1] + 1:
+            if last > merged[-1][1]:
+                merged[-1][1] = last
+        else:
+            merged.append([first, last])
+    return merged
+
+
+def freeBlocks(cidr, mask, used):
+    ''' yields the first address of each free, aligned /mask block in cidr,
+        walking the merged used ranges once
+    '''
+    first, last = cidrRange(cidr)
+    size = 1 << (32 - int(mask))
+    cur = first
+    i = 0
+    while cur + size - 1 <= last:
+        while i < len(used) and used[i][1] < cur:
+            i += 1
+        if i < len(used) and used[i][0] <= cur + size - 1:
+            cur = (used[i][1] + size) // size * size
+            continue
+        yield cur
+        cur += size
+
+
+async def aGetSubnets(aiodash, sem, network):
+    async with sem:
+        try:
+            vlans = await aiodash.appliance.getNetworkApplianceVlans(network['id'])
+        except meraki.APIError as e:
+            print(f"{network['name']}: {e.message}")
+            # None, not [], so callers can tell an unreadable network from one without VLANs
+            vlans = None
+    return network, vlans
+
+
+async def aioallsubnets(networks):
+    async with aiodashboard() as aiodash:
+        sem = asyncio.Semaphore(PLAN_CONCURRENCY)
+        return await asyncio.gather(*[aGetSubnets(aiodash, sem, network) for network in networks])
+
+
+def allocate(dashboard, orgId, templateName, targetNames):
+    ''' hands out the next free /mask block of every template VLAN to each
+        target network, with the first host as the appliance IP, and writes
+        the allocations as a plan file for -p
+    '''
+    templates = getOrgTemplates(dashboard, orgId)
+    try:
+        templateId = [t['id'] for t in templates if t['name'] == templateName][0]
+    except IndexError:
+        print(f"{BOLD}Template {templateName} not found{ENDC}")
+        sys.exit()
+
+    tVlans = [tv for tv in getNetworkApplianceVlans(dashboard, templateId) if tv.get('cidr') and tv.get('mask')]
+    bound = [n for n in getNetworks(dashboard, orgId) if n.get('configTemplateId') == templateId]
+    targets = [n for n in bound if n['name'] in targetNames or n['id'] in targetNames]
+    missing = set(targetNames) - {n['name'] for n in targets} - {n['id'] for n in targets}
+    for name in missing:
+        print(f"{BOLD}{name}: not bound to template {templateName}{ENDC}")
+
+    print(f"Reading VLANs of {len(bound)} networks bound to {templateName}")
+    used = {str(tv['id']): [] for tv in tVlans}
+    unreadable = []
+    for network, vlans in asyncio.run(aioallsubnets(bound)):
+        if vlans is None:
+            unreadable.append(network['name'])
+            continue
+        for vlan in vlans:
+            if str(vlan['id']) in used and vlan.get('subnet'):
+                used[str(vlan['id'])].append(cidrRange(vlan['subnet']))
+    if unreadable:
+        # their blocks are unknown, allocating now could hand out a subnet already in use
+        print(f"{BOLD}Could not read VLANs of {len(unreadable)} networks bound to {templateName}, no plan written:{ENDC}")
+        for name in unreadable:
+            print(f"  {name}")
+        sys.exit()
+
+    plan = []
+    for tv in tVlans:
+        vlanId = str(tv['id'])
+        blocks = freeBlocks(tv['cidr'], tv['mask'], mergeRanges(used[vlanId]))
+        for network in targets:
+            block = next(blocks, None)
+            if block is None:
+                print(f"{BOLD}VLAN {vlanId}: {tv['cidr']} has no free /{tv['mask']} left for {network['name']}{ENDC}")
+                continue
+            plan.append({'network': network['name'],
+                         'vlanId': vlanId,
+                         'applianceIp': intToIp(block + 1),
+                         'subnet': f"{intToIp(block)}/{tv['mask']}"})
+
+    logdir = "report"
+    if not os.path.exists(logdir):
+        print("Creating report directory")
+        os.makedirs(logdir)
+
+    csvfile = f"{logdir}/alloc_{datetime.now():%Y%m%d-%H%M%S}.csv"
+    with open(csvfile, 'w', newline='') as cf:
+        writer = csv.DictWriter(cf, fieldnames=PLAN_FIELDS)
+        writer.writeheader()
+        for row in plan:
+            print(f"{row['network']} VLAN {row['vlanId']}: {row['applianceIp']} {row['subnet']}")
+            writer.writerow(row)
+    print(f"Wrote {len(plan)} allocations to {csvfile}, apply with -p {csvfile}")
+
+
+def findOverlaps(subnets):
+    ''' sweeps (first, last, label) ranges sorted by first address, keeping a
+        heap of the ranges still open, returns (kind, label, label) for every
+        duplicate or overlapping pair
+    '''
+    found = []
+    active = []
+    for first, last, label in sorted(subnets, key=lambda s: (s[0], s[1])):
+        while active and active[0][0] < first:
+            heapq.heappop(active)
+        for aLast, aFirst, aLabel in active:
+            kind = 'duplicate' if (aFirst, aLast) == (first, last) else 'overlap'
+            found.append((kind, aLabel, label))
+        heapq.heappush(active, (last, first, label))
+    return found
+
+
+def scan(dashboard, orgId):
+    ''' fetches every appliance network's VLANs and reports duplicate and
+        overlapping subnets and appliance IPs outside their own subnet
+    '''
+    networks = [n for n in getNetworks(dashboard, orgId) if 'appliance' in n['productTypes']]
+    print(f"Reading VLANs of {len(networks)} appliance networks")
+
+    subnets = []
+    report = []
+    failed = 0
+    for network, vlans in asyncio.run(aioallsubnets(networks)):
+        if vlans is None:
+            failed += 1
+            continue
+        for vlan in vlans:
+            if not vlan.get('subnet'):
+                continue
+            label = f"{network['name']} VLAN {vlan['id']} {vlan['subnet']}"
+            first, last = cidrRange(vlan['subnet'])
+            subnets.append((first, last, label))
+            if vlan.get('applianceIp') and not first <= ipToInt(vlan['applianceIp']) <= last:
+                report.append(('applianceIp outside subnet', label, vlan['applianceIp']))
+
+    report.extend(findOverlaps(subnets))
+    print(f"Checked {len(subnets)} subnets")
+
+    logdir = "report"
+    if not os.path.exists(logdir):
+        print("Creating report directory")
+        os.makedirs(logdir)
+
+    csvfile = f"{logdir}/scan_{datetime.now():%Y%m%d-%H%M%S}.csv"
+    with open(csvfile, 'w', newline='') as cf:
+        writer = csv.writer(cf)
+        writer.writerow(['issue', 'vlan', 'conflict'])
+        for row in report:
+            print(f"{BOLD}{row[0]}{ENDC}: {row[1]} / {row[2]}")
+            writer.writerow(row)
+
+    counts = {}
+    for kind, _, _ in report:
+        counts[kind] = counts.get(kind, 0) + 1
+    print(', '.join(f"{counts[k]} {k}" for k in counts) or "No conflicts found")
+    if failed:
+        print(f"{BOLD}{failed} networks could not be read, their subnets were not checked{ENDC}")
+    print(f"Wrote {csvfile}")
+
+
+def vlanDrift(tVlans, vlans):
+    ''' compares one spoke's VLANs with its template, returns (vlanId, issue, detail)
+    '''
+    template = {str(tv['id']): tv for tv in tVlans}
+    spoke = {str(v['id']): v for v in vlans}
+    issues = []
+    for vlanId in sorted(set(template) - set(spoke), key=int):
+        issues.append((vlanId, 'missing', f"template VLAN {template[vlanId]['name']}"))
+    for vlanId in sorted(set(spoke) - set(template), key=int):
+        issues.append((vlanId, 'extra', spoke[vlanId].get('subnet')))
+
+    for vlanId in sorted(set(template) & set(spoke), key=int):
+        tv = template[vlanId]
+        subnet = spoke[vlanId].get('subnet')
+        if not subnet:
+            continue
+        if tv.get('cidr') and tv.get('mask'):
+            first, last = cidrRange(subnet)
+            cFirst, cLast = cidrRange(tv['cidr'])
+            if not (cFirst <= first and last <= cLast):
+                issues.append((vlanId, 'outside cidr', f"{subnet} not in {tv['cidr']}"))
+            elif int(subnet.partition('/')[2]) != int(tv['mask']):
+                issues.append((vlanId, 'wrong mask', f"{subnet} is not a /{tv['mask']}"))
+        elif tv.get('subnet') and subnet != tv['subnet']:
+            issues.append((vlanId, 'subnet differs', f"{subnet} != {tv['subnet']}"))
+    return issues
+
+
+def drift(dashboard, orgId):
+    ''' checks every network bound to every template against its template's
+        VLANs, fetching each template's VLANs once alongside the spokes
+    '''
+    templates = {t['id']: t for t in getOrgTemplates(dashboard, orgId)}
+    bound = [n for n in getNetworks(dashboard, orgId) if n.get('configTemplateId') in templates]
+    print(f"Reading VLANs of {len(templates)} templates and {len(bound)} bound networks")
+
+    fetched = {network['id']: vlans for network, vlans in asyncio.run(aioallsubnets(list(templates.values()) + bound))}
+    index = applianceIndex(bound, getOrgAppliances(dashboard, orgId))
+
+    report = []
+    unreadable = []
+    for network in bound:
+        template = templates[network['configTemplateId']]
+        serials = ' '.join(a['serial'] for a in index[network['id']]['appliances'])
+        if fetched[template['id']] is None or fetched[network['id']] is None:
+            # without both VLAN lists there is nothing to compare, not the same as no drift
+            what = 'template' if fetched[template['id']] is None else 'network'
+            unreadable.append((template['name'], network['name'], serials, '', 'unreadable', f"{what} VLANs could not be read"))
+            continue
+        for vlanId, issue, detail in vlanDrift(fetched[template['id']], fetched[network['id']]):
+            report.append((template['name'], network['name'], serials, vlanId, issue, detail))
+
+    logdir = "report"
+    if not os.path.exists(logdir):
+        print("Creating report directory")
+        os.makedirs(logdir)
+
+    csvfile = f"{logdir}/drift_{datetime.now():%Y%m%d-%H%M%S}.csv"
+    with open(csvfile, 'w', newline='') as cf:
+        writer = csv.writer(cf)
+        writer.writerow(['template', 'network', 'serial', 'vlanId', 'issue', 'detail'])
+        for row in report:
+            print(f"{row[0]} / {row[1]} VLAN {row[3]}: {BOLD}{row[4]}{ENDC} {row[5]}")
+            writer.writerow(row)
+        if unreadable:
+            print(f"\n{BOLD}Unreadable{ENDC}")
+        for row in unreadable:
+            print(f"{row[0]} / {row[1]}: {row[5]}")
+            writer.writerow(row)
+
+    drifted = len({row[1] for row in report})
+    print(f"{drifted} of {len(bound) - len(unreadable)} networks drift from their template")
+    if unreadable:
+        print(f"{BOLD}{len(unreadable)} networks could not be checked{ENDC}")
+    print(f"Wrote {csvfile}")
+
+
 def main():
     dashboard = meraki.DashboardAPI(
         api_key=os.getenv('APIKEY'),
-        base_url='https://api.meraki.com/api/v1/',
+        base_url=BASE_URL,
         output_log=False,
         log_file_prefix=os.path.basename(__file__)[:-3],
         log_path='',
@@ -129,6 +650,22 @@ def main():
         print(f"{BOLD}Organization name {orgname} not found{ENDC}")
         sys.exit()
 
+    if planfile:
+        applyPlan(dashboard, orgId, readPlan(planfile))
+        return
+
+    if allocTemplate:
+        allocate(dashboard, orgId, allocTemplate, allocTargets)
+        return
+
+    if scanOrg:
+        scan(dashboard, orgId)
+        return
+
+    if driftOrg:
+        drift(dashboard, orgId)
+        return
+
     networks = getNetworks(dashboard, orgId)
     try:
         netId = [network['id'] for network in networks if network['name'] == netname][0]
@@ -139,18 +676,25 @@ def main():
     templates = getOrgTemplates(dashboard, orgId)
     template = {t['id']: t for t in templates}
 
-    networkDetail = getNetwork(dashboard, netId)
-    templateId = networkDetail['configTemplateId']
-    
+    index = applianceIndex(networks, getOrgAppliances(dashboard, orgId, networkIds=[netId]))
+    templateId = index[netId]['templateId']
+    if not templateId:
+        print(f"{BOLD}Network {netname} is not bound to a template{ENDC}")
+        sys.exit()
+    if not index[netId]['appliances']:
+        print(f"{BOLD}Network {netname} has no appliance{ENDC}")
+        sys.exit()
+
     tVlans = getNetworkApplianceVlans(dashboard, templateId)
     templateVlans = {tv['id']: tv for tv in tVlans}
 
-    spoke = getSpoke(dashboard, netId)[0]
-    print(f"\nNetworkID:  {spoke['networkId']}   Network:  {netname}")
+    print(f"\nNetworkID:  {netId}   Network:  {netname}")
     print(f"TemplateID: {templateId}   Template: {template[templateId]['name']}")
+    for appliance in index[netId]['appliances']:
+        print()
+        print(f"MX Name: {appliance['name']}")
+        print(f"Serial:  {appliance['serial']}   MAC: {appliance['mac']}")
     print()
-    print(f"MX Name: {spoke['name']}")
-    print(f"Serial:  {spoke['serial']}   MAC: {spoke['mac']}\n")
 
     subnets = getSubnets(dashboard, netId)
     print("Addressing & VLANS\nSubnets\n")
@@ -164,6 +708,8 @@ def main():
 
     if rewrite:
         print()
+        actions = []
+        labels = []
         for subnet in subnets:
             cidr = ipaddress.ip_network(templateVlans[subnet['id']]['cidr'])
             mask = templateVlans[subnet['id']]['mask']
@@ -196,7 +742,12 @@ def main():
                         except:
                             print("Subnet needs to be valid and within template defined supernet")
 
-                    result = updateSubnets(dashboard, spoke['networkId'], subnet['id'], str(aIp), str(aSubnet))
+                    if batch:
+                        actions.append(vlanAction(dashboard, netId, subnet['id'], str(aIp), str(aSubnet)))
+                        labels.append(f"{netname} VLAN {subnet['id']}")
+                        break
+
+                    result = updateSubnets(dashboard, netId, subnet['id'], str(aIp), str(aSubnet))
                     print(f"\nVlanID: {result['id']:4} Vlan Name: {result['name']:15} MX IP: {result['applianceIp']:16} Subnet: {result['subnet']:20}\n")
                     break
                 elif q == "N":
@@ -204,6 +755,9 @@ def main():
                 else:
                     print("Enter Y or N")
 
+        if actions:
+            printBatchResults(asyncio.run(aiobatch(orgId, actions, labels)))
+
 if __name__ == "__main__":
     parser = ArgumentParser(description="Select options.")
     parser.add_argument('-o', type = str,
@@ -211,9 +765,21 @@ if __name__ == "__main__":
     parser.add_argument('-n', type = str,
                         help = 'Network name for operation (required)')
     parser.add_argument("-rw", action="store_true",
-                        help="Re-write subnet addresses")                  
+                        help="Re-write subnet addresses")
+    parser.add_argument("-b", action="store_true",
+                        help="Submit re-writes as action batches")
+    parser.add_argument("-p", type=str,
+                        help="Re-write from a CSV/YAML plan of network, vlanId, applianceIp, subnet")
+    parser.add_argument("--alloc", type=str,
+                        help="Template name to allocate free VLAN subnets from, for -n or --targets")
+    parser.add_argument("--targets", type=str,
+                        help="File of network names or IDs to allocate for, one per line")
+    parser.add_argument("--scan", action="store_true",
+                        help="Scan all networks for duplicate and overlapping VLAN subnets")
+    parser.add_argument("--drift", action="store_true",
+                        help="Report VLANs of template-bound networks that drift from their template")
     parser.add_argument("-v", action="store_true",
-                        help="verbose")  
+                        help="verbose")
     parser.add_argument("-d", action="store_true",
                         help="debug")
     args = parser.parse_args()
@@ -224,6 +790,12 @@ if __name__ == "__main__":
     orgname = None
     netname = None
     rewrite = False
+    batch = False
+    planfile = None
+    allocTemplate = None
+    allocTargets = []
+    scanOrg = False
+    driftOrg = False
 
     if not args.o:
         print('Specify an organization (-o) for operation')
@@ -231,7 +803,28 @@ if __name__ == "__main__":
     else:
         orgname = args.o
 
-    if not args.n:
+    if args.alloc:
+        allocTemplate = args.alloc
+        if args.targets:
+            with open(args.targets, 'r') as tf:
+                allocTargets = [line.strip() for line in tf if line.strip()]
+        elif args.n:
+            allocTargets = [args.n]
+        else:
+            print('Specify networks to allocate for with -n or --targets')
+            sys.exit()
+
+    if args.scan:
+        scanOrg = True
+
+    if args.drift:
+        driftOrg = True
+
+    if args.p:
+        planfile = args.p
+    elif args.alloc or args.scan or args.drift:
+        pass
+    elif not args.n:
         print('Specify an network (-n) for operation')
         sys.exit()
     else:
@@ -240,6 +833,9 @@ if __name__ == "__main__":
     if args.rw:
         rewrite = True
 
+    if args.b:
+        batch = True
+
     if args.v:
         logging.basicConfig(level=logging.INFO,
                             format="%(asctime)s - %(levelname)s - %(message)s")
@@ -1,14 +1,22 @@
 #!/usr/bin/env python
+import asyncio
 import logging
 import os
+import re
 import sys
+import time
 from datetime import datetime
 
 import meraki
+import meraki.aio
 from argparse import ArgumentParser
 
 BOLD = '\033[1m'
 ENDC = '\033[0m'
+GREEN = '\033[92m'
+RED = '\033[91m'
+
+MAC_RE = re.compile(r'^[0-9a-f]{12}$')
 
 
 def getOrganizations(dashboard):
@@ -25,12 +33,119 @@ def getNetworks(dashboard, org_id):
     return networks
 
 
-def getClients(dashboard, net_id):
-    clients = dashboard.networks.getNetworkClients(net_id, mac="01:12:23:34:45:56")
+def getClients(dashboard, net_id, mac=''):
+    clients = dashboard.networks.getNetworkClients(net_id, mac=mac)
     print(f'Found {len(clients)} clients')
     logging.debug(f'networks: {BOLD}{clients}{ENDC}')
     return clients
 
+
+def normalizeMac(mac):
+    ''' returns a lower case colon separated MAC, or None if it is not a MAC
+        accepts aa:bb:cc:dd:ee:ff, aa-bb-cc-dd-ee-ff, aabb.ccdd.eeff and aabbccddeeff
+    '''
+    digits = re.sub(r'[\s:.\-]', '', mac).lower()
+    if not MAC_RE.match(digits):
+        return None
+    return ':'.join(digits[i:i + 2] for i in range(0, 12, 2))
+
+
+def readMacs(path):
+    ''' reads MACs one per line from a file, or stdin with '-'
+        returns normalized MACs in input order with duplicates removed
+    '''
+    fh = sys.stdin if path == '-' else open(path, 'r')
+    macs = {}
+    invalid = 0
+    with fh:
+        for line in fh:
+            line = line.split('#')[0].strip()
+            if not line:
+                continue
+            mac = normalizeMac(line)
+            if mac:
+                macs[mac] = True
+            else:
+                invalid += 1
+                print(f'{RED}Skipping invalid MAC: {line}{ENDC}')
+    print(f'Read {len(macs)} unique MACs ({invalid} invalid)')
+    return list(macs)
+
+
+class RateLimiter:
+    ''' spaces calls evenly so no more than `rate` start per second
+    '''
+    def __init__(self, rate):
+        self.interval = 1 / rate
+        self.next_slot = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self.lock:
+            now = time.monotonic()
+            if self.next_slot > now:
+                await asyncio.sleep(self.next_slot - now)
+            self.next_slot = max(now, self.next_slot) + self.interval
+
+
+async def aGetOrgClient(aiodash, limiter, org_id, mac):
+    ''' one getOrganizationClientsSearch per MAC, returns None when not found
+    '''
+    await limiter.wait()
+    try:
+        result = await aiodash.organizations.getOrganizationClientsSearch(org_id, mac)
+    except meraki.APIError as e:
+        if e.status == 404:
+            return mac, None
+        raise
+    logging.debug(f'client {mac}: {BOLD}{result}{ENDC}')
+    return mac, result
+
+
+async def aiobulk(macs):
+    async with meraki.aio.AsyncDashboardAPI(
+        api_key=os.getenv('APIKEY'),
+        base_url='https://api.meraki.com/api/v1/',
+        output_log=False,
+        log_file_prefix=os.path.basename(__file__)[:-3],
+        log_path='',
+        print_console=False,
+        inherit_logging_config=True,
+        maximum_concurrent_requests=rate,
+        maximum_retries=100,
+        wait_on_rate_limit=True,
+    ) as aiodash:
+        orgs = await aiodash.organizations.getOrganizations()
+        org = next((o for o in orgs if o['name'] == target_org and o['api']['enabled']), None)
+        if not org:
+            print(f'Organization {target_org} not found or API not enabled')
+            return
+
+        print(f'Looking up {len(macs)} MACs in organization {org["name"]}:')
+        limiter = RateLimiter(rate)
+        tasks = [aGetOrgClient(aiodash, limiter, org['id'], mac) for mac in macs]
+
+        found = 0
+        for task in asyncio.as_completed(tasks):
+            try:
+                mac, result = await task
+            except meraki.APIError as e:
+                print(f'Meraki API error: {e}')
+                continue
+
+            if not result or not result.get('records'):
+                print(f'{RED}mac: {mac} not found{ENDC}')
+                continue
+
+            found += 1
+            for record in result['records']:
+                network = record.get('network') or {}
+                print(f'{GREEN}mac: {mac}{ENDC} network: {network.get("name")} ip: {record.get("ip")} '
+                      f'desc: {record.get("description")} status: {record.get("status")} '
+                      f'lastSeen: {record.get("lastSeen")}')
+
+        print(f'\nResolved {found} of {len(macs)} MACs')
+
 def main():
     dashboard = meraki.DashboardAPI(
         api_key=os.getenv('APIKEY'),
@@ -54,7 +169,7 @@ def main():
             networks = getNetworks(dashboard, org["id"])
             for network in networks:
                 print(f'Network: {network["name"]}')
-                clients = getClients(dashboard, network["id"])
+                clients = getClients(dashboard, network["id"], mac=target_mac)
                 for client in clients:
                     print(f'id: {client["id"]} mac: {client["mac"]} desc: {client["description"]} status: {client["status"]}')
 
@@ -78,6 +193,13 @@ if __name__ == '__main__':
     #                     help = 'Network name for operation')
     parser.add_argument('-t', type = str,
                         help = 'Tag name for operation (one tag only)')
+    parser.add_argument('--mac', type = str,
+                        help = 'MAC address to search for in each network')
+    parser.add_argument('-f', type = str,
+                        help = "File of MACs, one per line ('-' for stdin), resolved with org-level client search")
+    parser.add_argument('--rate', type = int,
+                        default=10,
+                        help = 'Maximum lookups per second with -f (Default: 10)')
     parser.add_argument('-c', action = 'store_true',
                         help = 'Clear ContentFilter for targets')
     parser.add_argument('-v', action = 'store_true',
@@ -91,6 +213,7 @@ if __name__ == '__main__':
     target_network = None
     net_tag = None
     clear_filter = False
+    target_mac = ''
 
     if args.v:
         print_console = True
@@ -117,7 +240,19 @@ if __name__ == '__main__':
     if args.c:
         clear_filter = True
 
+    if args.mac:
+        target_mac = args.mac
+
+    if args.rate < 1:
+        print('--rate must be at least 1')
+        sys.exit()
+    else:
+        rate = args.rate
+
     start_time = datetime.now()
-    main()
+    if args.f:
+        asyncio.run(aiobulk(readMacs(args.f)))
+    else:
+        main()
     end_time = datetime.now()
     print(f'\nScript complete, total runtime {end_time - start_time}')
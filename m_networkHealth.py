@@ -1,9 +1,12 @@
 #!/usr/bin/env python
 import asyncio
 import csv
+import hashlib
 import os
 import logging
+import sqlite3
 import sys
+import time
 import meraki
 import meraki.aio
 
@@ -21,6 +24,8 @@ PURPLE = "\033[35m"
 LGRAY = "\033[97m"
 DGRAY = "\033[90m"
 
+WATCH_CONCURRENCY = 10      # networks polled at once in watch mode
+
 
 async def aGetOrgs(aiodash, org_name=None, org_id=None):
     if org_id:
@@ -91,6 +96,216 @@ def csv_writer(alerts, net_map):
                 print(f"{net_map[alert]} has no alerts.")
 
 
+def alertFingerprints(net_id, alerts):
+    ''' returns {fingerprint: alert row} with one fingerprint per alert and
+        device, hashed from network, category, type and device serial
+    '''
+    result = {}
+    for a in alerts or []:
+        devices = a['scope'].get('devices') or [{}]
+        for dev in devices:
+            key = f"{net_id}|{a['category']}|{a['type']}|{dev.get('serial', '')}"
+            fp = hashlib.sha1(key.encode()).hexdigest()
+            result[fp] = {
+                'networkId': net_id,
+                'category': a['category'],
+                'type': a['type'],
+                'severity': a['severity'],
+                'productType': dev.get('productType'),
+                'deviceName': dev.get('name'),
+                'mac': dev.get('mac'),
+                'serial': dev.get('serial'),
+                'url': dev.get('url'),
+            }
+    return result
+
+
+def store_open(path):
+    ''' opens (and creates if needed) the alert history store, one row per
+        alert fingerprint and one interval row per time it was seen alerting
+    '''
+    storedir = os.path.dirname(path)
+    if storedir and not os.path.exists(storedir):
+        os.makedirs(storedir)
+
+    con = sqlite3.connect(path)
+    con.row_factory = sqlite3.Row
+    con.executescript('''
+        CREATE TABLE IF NOT EXISTS alerts (
+            fingerprint  TEXT PRIMARY KEY,
+            network_id   TEXT NOT NULL,
+            network_name TEXT,
+            category     TEXT,
+            type         TEXT,
+            severity     TEXT,
+            product_type TEXT,
+            device_name  TEXT,
+            mac          TEXT,
+            serial       TEXT,
+            url          TEXT
+        );
+        CREATE TABLE IF NOT EXISTS intervals (
+            fingerprint  TEXT NOT NULL REFERENCES alerts (fingerprint),
+            first_seen   REAL NOT NULL,
+            last_seen    REAL NOT NULL,
+            open         INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS alerts_network ON alerts (network_id);
+        CREATE INDEX IF NOT EXISTS alerts_network_name ON alerts (network_name);
+        CREATE INDEX IF NOT EXISTS alerts_serial ON alerts (serial);
+        CREATE INDEX IF NOT EXISTS alerts_type ON alerts (type);
+        CREATE INDEX IF NOT EXISTS alerts_severity ON alerts (severity);
+        CREATE INDEX IF NOT EXISTS intervals_fingerprint ON intervals (fingerprint, open);
+        CREATE INDEX IF NOT EXISTS intervals_first_seen ON intervals (first_seen);
+    ''')
+    return con
+
+
+def store_alerts(con, net_id, net_name, current, now=None):
+    ''' extends the open interval of every current alert, opens one for new
+        alerts and closes the ones no longer reported for the network
+    '''
+    now = now or time.time()
+    open_fps = {r['fingerprint'] for r in con.execute(
+        'SELECT i.fingerprint FROM intervals i JOIN alerts a USING (fingerprint) '
+        'WHERE a.network_id = ? AND i.open = 1', (net_id,))}
+
+    for fp, alert in current.items():
+        con.execute('INSERT OR REPLACE INTO alerts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (fp, net_id, net_name, alert['category'], alert['type'], alert['severity'],
+                     alert['productType'], alert['deviceName'], alert['mac'], alert['serial'], alert['url']))
+        if fp in open_fps:
+            con.execute('UPDATE intervals SET last_seen = ? WHERE fingerprint = ? AND open = 1', (now, fp))
+        else:
+            con.execute('INSERT INTO intervals VALUES (?, ?, ?, 1)', (fp, now, now))
+
+    for fp in open_fps - current.keys():
+        con.execute('UPDATE intervals SET open = 0 WHERE fingerprint = ? AND open = 1', (fp,))
+    con.commit()
+
+
+def store_query(con):
+    ''' prints alert history matching the -n/--serial/--type/--severity filters,
+        or the devices that spent the longest alerting with --top
+    '''
+    filters = {}
+    if net_name:
+        filters['a.network_name'] = net_name
+    if args.serial:
+        filters['a.serial'] = args.serial
+    if args.type:
+        filters['a.type'] = args.type
+    if args.severity:
+        filters['a.severity'] = args.severity
+    where = ' AND '.join(f'{column} = ?' for column in filters) or '1'
+
+    if args.top:
+        rows = con.execute(f'''
+            SELECT a.network_name, a.device_name, a.serial, COUNT(*) AS times,
+                   SUM(i.last_seen - i.first_seen) AS alerting, MAX(i.open) AS active
+            FROM intervals i JOIN alerts a USING (fingerprint)
+            WHERE {where}
+            GROUP BY a.network_id, a.serial
+            ORDER BY alerting DESC, times DESC
+            LIMIT ?''', (*filters.values(), args.top)).fetchall()
+        for r in rows:
+            active = f" {RED}active{ENDC}" if r['active'] else ""
+            print(f"{r['network_name']}, {r['device_name'] or '-'} ({r['serial'] or '-'}): "
+                  f"{r['times']} times, {int(r['alerting']) // 60} min alerting{active}")
+        return
+
+    rows = con.execute(f'''
+        SELECT a.*, i.first_seen, i.last_seen, i.open
+        FROM intervals i JOIN alerts a USING (fingerprint)
+        WHERE {where}
+        ORDER BY i.first_seen''', tuple(filters.values())).fetchall()
+    for r in rows:
+        state = f"{RED}active{ENDC}" if r['open'] else "cleared"
+        print(f"{datetime.fromtimestamp(r['first_seen']):%Y-%m-%d %H:%M} - "
+              f"{datetime.fromtimestamp(r['last_seen']):%Y-%m-%d %H:%M} {state} "
+              f"{r['network_name']}, {r['device_name'] or '-'} ({r['serial'] or '-'}): "
+              f"{r['category']} / {r['type']} ({r['severity']})")
+    print(f"{len(rows)} alert intervals")
+
+
+async def aPollAlerts(aiodash, sem, net_id):
+    ''' one watch poll, any failure (API error, timeout, SDK error) returns
+        None so the watch loop backs off instead of stopping
+    '''
+    async with sem:
+        try:
+            return await aGetNetworkHealthAlerts(aiodash, net_id)
+        except meraki.APIError as e:
+            print(f"{datetime.now():%H:%M:%S} {YELLOW}poll failed{ENDC} {net_id}: {e}")
+            return net_id, None
+        except Exception as e:
+            print(f"{datetime.now():%H:%M:%S} {YELLOW}poll failed{ENDC} {net_id}: {e!r}")
+            return net_id, None
+
+
+async def aWatch(aiodash, eligible_networks, net_map):
+    ''' polls each network on its own interval, starting at the base interval
+        and doubling up to the max while a network's alerts stay the same,
+        and prints only new and cleared alerts
+    '''
+    if not eligible_networks:
+        print(f"{RED}No networks to watch{ENDC}")
+        return
+
+    logdir = "report"
+    if not os.path.exists(logdir):
+        print("Creating report directory")
+        os.makedirs(logdir)
+
+    csvfile = f"{logdir}/alert_changes_{datetime.now():%Y%m%d-%H%M%S}.csv"
+    print(f"Watching {len(eligible_networks)} networks, logging changes to {csvfile}")
+
+    known = {}
+    interval = {net_id: watch_interval for net_id in eligible_networks}
+    next_poll = {net_id: 0 for net_id in eligible_networks}
+    sem = asyncio.Semaphore(WATCH_CONCURRENCY)
+
+    with open(csvfile, 'w', newline='') as cf:
+        fieldnames = ['time', 'change', 'networkName', 'networkId', 'category', 'type',
+                      'severity', 'deviceName', 'serial']
+        writer = csv.DictWriter(cf, fieldnames=fieldnames, extrasaction='ignore')
+        writer.writeheader()
+
+        while True:
+            now = time.monotonic()
+            due = [net_id for net_id in next_poll if next_poll[net_id] <= now]
+            for task in asyncio.as_completed([aPollAlerts(aiodash, sem, net_id) for net_id in due]):
+                net_id, alerts = await task
+                if alerts is None:
+                    interval[net_id] = min(interval[net_id] * 2, watch_max)
+                    next_poll[net_id] = time.monotonic() + interval[net_id]
+                    continue
+
+                current = alertFingerprints(net_id, alerts)
+                previous = known.get(net_id, {})
+                changes = [('new', current[fp]) for fp in current.keys() - previous.keys()]
+                changes += [('cleared', previous[fp]) for fp in previous.keys() - current.keys()]
+                known[net_id] = current
+                if store:
+                    store_alerts(store, net_id, net_map[net_id], current)
+
+                if changes:
+                    interval[net_id] = watch_interval
+                else:
+                    interval[net_id] = min(interval[net_id] * 2, watch_max)
+                next_poll[net_id] = time.monotonic() + interval[net_id]
+
+                for change, alert in changes:
+                    color = RED if change == 'new' else GREEN
+                    print(f"{datetime.now():%H:%M:%S} {color}{change:>7}{ENDC} {net_map[net_id]}: "
+                          f"{alert['category']} / {alert['type']} ({alert['severity']}) {alert['deviceName'] or ''}")
+                    writer.writerow({'time': f"{datetime.now():%Y-%m-%d %H:%M:%S}", 'change': change,
+                                     'networkName': net_map[net_id], **alert})
+                cf.flush()
+
+            await asyncio.sleep(max(0, min(next_poll.values()) - time.monotonic()))
+
+
 async def aiomain():
     async with meraki.aio.AsyncDashboardAPI(
         api_key=os.getenv("APIKEY"),
@@ -130,6 +345,10 @@ async def aiomain():
                     eligible_networks[net['id']] = net
                     net_map[net['id']] = net['name']
             
+        if watch:
+            await aWatch(aiodash, eligible_networks, net_map)
+            return
+
         nh_report = {}
         tasks = []
 
@@ -139,7 +358,9 @@ async def aiomain():
         for task in asyncio.as_completed(tasks):
             nid, result = await task
             nh_report[nid] = result
-        
+            if store:
+                store_alerts(store, nid, net_map[nid], alertFingerprints(nid, result))
+
         if args.nocsv: # csv is the only output currently, no real need for this
             pass
         else:
@@ -154,6 +375,19 @@ if __name__ == "__main__":
     parser.add_argument("-i", type=str, help="Organization ID for operation")
     parser.add_argument("-n", type=str, help="Network name for operation")
     parser.add_argument("--nocsv", action="store_true", help="Output CSV to file")
+    parser.add_argument("--watch", action="store_true", help="Keep polling and print only new and cleared alerts")
+    parser.add_argument("--interval", type=int, default=60, help="Watch poll interval in seconds (Default: 60)")
+    parser.add_argument("--max-interval", type=int, default=900,
+                        help="Longest poll interval for quiet networks in seconds (Default: 900)")
+    parser.add_argument("--store", action="store_true", help="Record alerts in the alert history store")
+    parser.add_argument("--db", type=str, default=os.path.join("report", "alerts.db"),
+                        help="Alert history store path (Default: report/alerts.db)")
+    parser.add_argument("--query", action="store_true",
+                        help="Show alert history from the store, filtered by -n, --serial, --type, --severity")
+    parser.add_argument("--serial", type=str, help="Device serial to query")
+    parser.add_argument("--type", type=str, help="Alert type to query")
+    parser.add_argument("--severity", type=str, help="Alert severity to query")
+    parser.add_argument("--top", type=int, help="With --query, show the N devices alerting longest")
     parser.add_argument("--log", action="store_true", help="Log to file")
     parser.add_argument("-v", action="store_true", help="verbose")
     parser.add_argument("-d", action="store_true", help="debug")
@@ -171,6 +405,9 @@ if __name__ == "__main__":
     elif args.i:
         oid = args.i
         org_name = None
+    elif args.query:
+        oid = None
+        org_name = None
     else:
         print(f"{RED}Must define an Org with -o or -i option{ENDC}")
         sys.exit()
@@ -199,6 +436,13 @@ if __name__ == "__main__":
         logger.addHandler(handler_console)
         logger.propagate = False
 
+    if args.watch:
+        watch = True
+        watch_interval = max(args.interval, 1)
+        watch_max = max(args.max_interval, watch_interval)
+    else:
+        watch = False
+
     if args.log:
         suppress_logging = False
         output_log = True
@@ -209,7 +453,18 @@ if __name__ == "__main__":
         suppress_logging = True
         output_log = False
 
-    asyncio.run(aiomain())
+    if args.query:
+        store = store_open(args.db)
+        store_query(store)
+    else:
+        store = store_open(args.db) if args.store else None
+        try:
+            asyncio.run(aiomain())
+        except KeyboardInterrupt:
+            print("\nStopped")
+
+    if store:
+        store.close()
 
     end_time = datetime.now()
     print(f"\nScript complete, total runtime {end_time - start_time}")
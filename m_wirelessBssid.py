@@ -3,12 +3,23 @@ import asyncio
 import csv
 import os
 import logging
+import pickle
+import re
+import sqlite3
 import sys
 import meraki
 import meraki.aio
+import numpy as np
 
 from argparse import ArgumentParser
 from datetime import datetime
+from functools import lru_cache
+
+LOOKUP_CHUNK = 500
+DIFF_FIELDS = ['channel', 'width', 'power', 'broadcasting']
+BAND_BASE_MHZ = {'2.4': 2407, '5': 5000, '6': 5950}
+POWER_MAD_SCALE = 3 * 1.4826    # ~3 standard deviations for normally distributed power
+POWER_MIN_DEVIATION = 6         # dB, never flag smaller deviations from the band median
 
 BOLD = "\033[1m"
 ENDC = "\033[0m"
@@ -58,7 +69,166 @@ async def aGetWirelessStatus(aiodash, serial):
     result = await aiodash.wireless.getDeviceWirelessStatus(serial)
     logger.debug(f"aGetWirelessStatus: {CYAN}{result}{ENDC}")
     return serial, result
-        
+
+
+def withUnit(value, unit):
+    ''' returns the org endpoint's bare number (5, "2.4", 20) in the per-device
+        string format ("5 GHz", "2.4 GHz", "20 MHz"), leaves None and values
+        that already carry a unit alone
+    '''
+    if value is None or isinstance(value, bool):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    text = str(value).strip()
+    try:
+        float(text)
+    except ValueError:
+        return value
+    return f"{text} {unit}"
+
+
+async def aGetOrgSsidStatuses(aiodash, org_id):
+    ''' returns {serial: status} for every AP from the paginated org-level
+        SSID status endpoint, in the same shape and value format as
+        getDeviceWirelessStatus
+    '''
+    result = await aiodash.wireless.getOrganizationWirelessSsidsStatusesByDevice(
+        org_id, perPage=500, total_pages="all", hideDisabled=False
+    )
+    items = result["items"] if isinstance(result, dict) else result
+    logger.debug(f"aGetOrgSsidStatuses: {CYAN}{len(items)} devices{ENDC}")
+
+    statuses = {}
+    for item in items:
+        bss = []
+        for s in item.get("basicServiceSets", []):
+            ssid = s.get("ssid", {})
+            radio = s.get("radio", {})
+            bss.append({
+                "ssidName": ssid.get("name"),
+                "ssidNumber": ssid.get("number"),
+                "enabled": ssid.get("enabled"),
+                "band": withUnit(radio.get("band"), "GHz"),
+                "bssid": s.get("bssid"),
+                "channel": radio.get("channel"),
+                "channelWidth": withUnit(radio.get("channelWidth"), "MHz"),
+                "power": withUnit(radio.get("power"), "dBm"),
+                "visible": ssid.get("visible"),
+                "broadcasting": radio.get("isBroadcasting"),
+            })
+        statuses[item["serial"]] = {"basicServiceSets": bss}
+    return statuses
+
+
+def bssidToInt(bssid):
+    ''' returns the 48-bit integer for a BSSID in any of the common MAC
+        notations (aa:bb:.., aa-bb-.., aabb.ccdd.., bare hex), None if invalid
+    '''
+    digits = re.sub(r"[\s:.\-]", "", bssid or "")
+    if len(digits) != 12:
+        return None
+    try:
+        return int(digits, 16)
+    except ValueError:
+        return None
+
+
+def intToBssid(value):
+    digits = f"{value:012x}"
+    return ":".join(digits[i:i + 2] for i in range(0, 12, 2))
+
+
+def index_open(path):
+    ''' opens (and creates if needed) the BSSID index, keyed by the BSSID as
+        an integer so the key is the table's rowid
+    '''
+    indexdir = os.path.dirname(path)
+    if indexdir and not os.path.exists(indexdir):
+        os.makedirs(indexdir)
+
+    con = sqlite3.connect(path)
+    con.row_factory = sqlite3.Row
+    con.executescript('''
+        CREATE TABLE IF NOT EXISTS bssids (
+            bssid       INTEGER PRIMARY KEY,
+            serial      TEXT NOT NULL,
+            name        TEXT,
+            network     TEXT,
+            ssid        TEXT,
+            band        TEXT,
+            channel     TEXT,
+            indexed_at  REAL NOT NULL
+        );
+    ''')
+    return con
+
+
+def index_devices(con, devices, net_map):
+    ''' upserts every BSS seen this run, including unconfigured SSIDs; BSSIDs
+        no longer reported keep their last known owner
+    '''
+    now = datetime.now().timestamp()
+    rows = []
+    for dev in devices.values():
+        detail = dev['detail']
+        for s in dev['status']['basicServiceSets']:
+            bssid = bssidToInt(s['bssid'])
+            if bssid is None:
+                continue
+            rows.append((bssid, detail['serial'], detail['name'], net_map.get(detail['networkId']),
+                         s['ssidName'], s['band'], str(s['channel']), now))
+
+    con.executemany('INSERT OR REPLACE INTO bssids VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+    con.commit()
+    total = con.execute('SELECT COUNT(*) FROM bssids').fetchone()[0]
+    print(f"Indexed {len(rows)} BSSIDs, {total} in {args.db}")
+
+
+def readBssids(path):
+    ''' one BSSID per line, "-" reads stdin, blank lines and # comments skipped
+    '''
+    fh = sys.stdin if path == "-" else open(path)
+    with fh:
+        return [line.split("#")[0].strip() for line in fh if line.split("#")[0].strip()]
+
+
+def lookup(path):
+    ''' resolves BSSIDs from a file against the local index, no API calls
+    '''
+    if not os.path.exists(args.db):
+        print(f"{RED}No BSSID index at {args.db}, run with --index first{ENDC}")
+        sys.exit()
+
+    con = index_open(args.db)
+    entries = readBssids(path)
+    wanted = {}
+    for entry in entries:
+        value = bssidToInt(entry)
+        if value is None:
+            print(f"{YELLOW}Skipping invalid BSSID {entry}{ENDC}")
+        else:
+            wanted[value] = entry
+
+    found = {}
+    keys = list(wanted)
+    for i in range(0, len(keys), LOOKUP_CHUNK):
+        chunk = keys[i:i + LOOKUP_CHUNK]
+        for r in con.execute(f'SELECT * FROM bssids WHERE bssid IN ({",".join("?" * len(chunk))})', chunk):
+            found[r['bssid']] = r
+    con.close()
+
+    for value in wanted:
+        r = found.get(value)
+        if r:
+            age = int(datetime.now().timestamp() - r['indexed_at'])
+            print(f"{intToBssid(value)}: {r['name']} ({r['serial']}), {r['network']}, "
+                  f"{r['ssid']}, {r['band']} ch {r['channel']} {DGRAY}[{age // 3600}h old]{ENDC}")
+        else:
+            print(f"{intToBssid(value)}: {RED}not found{ENDC}")
+
+    print(f"\n{len(found)} of {len(wanted)} BSSIDs found")
+
 
 def csv_writer(devices, net_map):
     logdir = "report"
@@ -105,6 +275,218 @@ def csv_writer(devices, net_map):
                     })
 
 
+def snapshot(devices, net_map):
+    ''' returns {bssid int: (name, serial, network, ssid, band, *DIFF_FIELDS)}
+        for every BSS seen this run
+    '''
+    snap = {}
+    for dev in devices.values():
+        detail = dev['detail']
+        network = net_map.get(detail['networkId'])
+        for s in dev['status']['basicServiceSets']:
+            bssid = bssidToInt(s['bssid'])
+            if bssid is not None:
+                snap[bssid] = (detail['name'], detail['serial'], network, s['ssidName'], s['band'],
+                               s['channel'], s['channelWidth'], s['power'], s['broadcasting'])
+    return snap
+
+
+def diffSnapshots(old, new):
+    ''' single pass over the new snapshot probing the old one by BSSID; yields
+        (change, bssid, before, after) for added, removed and changed BSSs
+    '''
+    old = dict(old)
+    for bssid, after in new.items():
+        before = old.pop(bssid, None)
+        if before is None:
+            yield 'added', bssid, None, after
+        elif before[5:] != after[5:]:
+            yield 'changed', bssid, before, after
+    for bssid, before in old.items():
+        yield 'removed', bssid, before, None
+
+
+def diff(devices, net_map, org_id):
+    ''' compares this run against the previous snapshot for the org, writes
+        only the differences and replaces the snapshot
+    '''
+    logdir = "report"
+    if not os.path.exists(logdir):
+        print("Creating report directory")
+        os.makedirs(logdir)
+
+    snapfile = f"{logdir}/bss_snapshot_{org_id}.pickle"
+    new = snapshot(devices, net_map)
+
+    if os.path.exists(snapfile):
+        with open(snapfile, 'rb') as fh:
+            old = pickle.load(fh)
+
+        counts = {'added': 0, 'removed': 0, 'changed': 0}
+        csvfile = f"{logdir}/bss_changes_{datetime.now():%Y%m%d-%H%M%S}.csv"
+        with open(csvfile, 'w', newline='') as cf:
+            writer = csv.writer(cf)
+            writer.writerow(['change', 'bssid', 'name', 'serial', 'networkName', 'ssid', 'band'] +
+                            [f'{f}{side}' for f in DIFF_FIELDS for side in ('Before', 'After')])
+            for change, bssid, before, after in diffSnapshots(old, new):
+                counts[change] += 1
+                ident = (after or before)[:5]
+                values = []
+                for i in range(len(DIFF_FIELDS)):
+                    values.append(before[5 + i] if before else '')
+                    values.append(after[5 + i] if after else '')
+                writer.writerow([change, intToBssid(bssid), *ident, *values])
+
+        print(f"{GREEN}{counts['added']} added{ENDC}, {RED}{counts['removed']} removed{ENDC}, "
+              f"{YELLOW}{counts['changed']} changed{ENDC} BSSs since last snapshot")
+        print(f"Writing {csvfile}")
+    else:
+        print(f"No previous snapshot for org {org_id}, saving baseline")
+
+    with open(f"{snapfile}.partial", 'wb') as fh:
+        pickle.dump(new, fh, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(f"{snapfile}.partial", snapfile)
+
+
+@lru_cache(maxsize=None)
+def leadingNumber(value):
+    ''' "36", "18 dBm", "80 MHz" -> float; radios report a handful of distinct values '''
+    match = re.match(r"\s*(\d+(?:\.\d+)?)", value)
+    return float(match.group(1)) if match else None
+
+
+def radioTable(devices, net_map):
+    ''' one row per broadcasting radio (serial, band), since every SSID on a
+        radio shares its channel, width and power
+    '''
+    radios = {}
+    for dev in devices.values():
+        detail = dev['detail']
+        for s in dev['status']['basicServiceSets']:
+            band = str(s['band'] or '').split()[0] if s['band'] else None
+            if band not in BAND_BASE_MHZ or not s['broadcasting'] or (detail['serial'], band) in radios:
+                continue
+            channel = leadingNumber(str(s['channel']))
+            width = leadingNumber(str(s['channelWidth'])) or 20
+            power = leadingNumber(str(s['power']))
+            if channel is None:
+                continue
+            radios[(detail['serial'], band)] = (net_map.get(detail['networkId'], detail['networkId']),
+                                                detail['name'], detail['serial'], band,
+                                                int(channel), int(width), power)
+    return list(radios.values())
+
+
+def spectrum(band, channel, width):
+    ''' returns (primary, lo, hi) in MHz and the first 20 MHz channel of the
+        block as arrays; bonded 5/6 GHz channels occupy the aligned 40/80/160 MHz
+        block containing the primary, 2.4 GHz channels the 22 MHz DSSS mask
+    '''
+    base = np.array([BAND_BASE_MHZ[b] for b in band])
+    primary = base + 5 * channel
+    narrow = (band == '2.4') | (width <= 20)
+
+    # channel numbers step 4 per 20 MHz; 5 GHz UNII-3 blocks start at 149, 6 GHz at 1
+    origin = np.where(band == '6', 1, np.where(channel >= 149, 149, 36))
+    span = np.maximum(width // 5, 4)
+    first = np.where(narrow, channel, origin + (channel - origin) // span * span)
+    half = np.where(band == '2.4', 11, 10)
+    lo = np.where(narrow, primary - half, base + 5 * first - 10)
+    hi = np.where(narrow, primary + half, lo + width)
+    return primary, lo, hi, first
+
+
+def groupMedian(values, starts, counts):
+    ''' per-group median of values already sorted by (group, value) '''
+    return (values[starts + (counts - 1) // 2] + values[starts + counts // 2]) / 2
+
+
+def rfAnalysis(devices, net_map):
+    ''' per network and band: co-channel and overlapping neighbour counts,
+        20 MHz channel occupancy and radios running anomalous power
+    '''
+    table = radioTable(devices, net_map)
+    if not table:
+        print("No broadcasting radios to analyse")
+        return
+
+    network, name, serial, band, channel, width, power = (np.array(c) for c in zip(*table))
+    channel = channel.astype(np.int64)
+    width = width.astype(np.int64)
+    power = np.array([np.nan if p is None else p for p in power], dtype=float)
+
+    keys, group = np.unique(np.char.add(np.char.add(network.astype(str), '\t'), band), return_inverse=True)
+    primary, lo, hi, first = spectrum(band, channel, width)
+
+    # same primary channel in the same network and band
+    _, cc_inv, cc_counts = np.unique(group * 100000 + primary, return_inverse=True, return_counts=True)
+    cochannel = cc_counts[cc_inv] - 1
+
+    # spectrum intersections within the group: #(lo_j < hi_i) - #(hi_j <= lo_i),
+    # earlier groups cancel out of both terms
+    offset = group * 100000
+    intersecting = (np.searchsorted(np.sort(offset + lo), offset + hi, side='left') -
+                    np.searchsorted(np.sort(offset + hi), offset + lo, side='right'))
+    overlapping = intersecting - 1 - cochannel
+
+    # power against the robust (median/MAD) centre of its network and band
+    valid = ~np.isnan(power)
+    median = np.full(len(power), np.nan)
+    anomaly = np.zeros(len(power), dtype=bool)
+    if valid.any():
+        vg, vp = group[valid], power[valid]
+        order = np.lexsort((vp, vg))
+        ug, starts, counts = np.unique(vg[order], return_index=True, return_counts=True)
+        med = np.full(len(keys), np.nan)
+        med[ug] = groupMedian(vp[order], starts, counts)
+        dev = np.abs(vp - med[vg])
+        order = np.lexsort((dev, vg))
+        mad = np.zeros(len(keys))
+        mad[ug] = groupMedian(dev[order], starts, counts)
+        median = med[group]
+        anomaly[valid] = dev > np.maximum(POWER_MAD_SCALE * mad[vg], POWER_MIN_DEVIATION)
+
+    # 20 MHz sub-channel occupancy, bonded radios count on every sub-channel they cover
+    subs = np.where(band == '2.4', 1, np.maximum(width // 20, 1))
+    step = np.arange(subs.sum()) - np.repeat(np.cumsum(subs) - subs, subs)
+    sub_keys = np.repeat(group, subs) * 1000 + np.repeat(first, subs) + 4 * step
+    hist_keys, hist_counts = np.unique(sub_keys, return_counts=True)
+    hist_bounds = np.searchsorted(hist_keys // 1000, np.arange(len(keys) + 1))
+
+    n = len(keys)
+    radios = np.bincount(group, minlength=n)
+    cc_radios = np.bincount(group, weights=cochannel > 0, minlength=n).astype(int)
+    ov_radios = np.bincount(group, weights=overlapping > 0, minlength=n).astype(int)
+    outliers = np.bincount(group, weights=anomaly, minlength=n).astype(int)
+
+    for g, key in enumerate(keys):
+        net, b = key.split('\t')
+        lo_h, hi_h = hist_bounds[g], hist_bounds[g + 1]
+        usage = " ".join(f"{c % 1000}:{k}" for c, k in zip(hist_keys[lo_h:hi_h], hist_counts[lo_h:hi_h]))
+        print(f"{BOLD}{net}{ENDC} {b} GHz: {radios[g]} radios, "
+              f"{YELLOW}{cc_radios[g]} co-channel{ENDC}, "
+              f"{YELLOW}{ov_radios[g]} overlapping{ENDC}, "
+              f"{RED}{outliers[g]} power outliers{ENDC}")
+        print(f"    {DGRAY}channel use {usage}{ENDC}")
+
+    logdir = "report"
+    if not os.path.exists(logdir):
+        print("Creating report directory")
+        os.makedirs(logdir)
+
+    csvfile = f"{logdir}/rf_{datetime.now():%Y%m%d-%H%M%S}.csv"
+    print(f"Writing {csvfile}")
+    with open(csvfile, 'w', newline='') as cf:
+        writer = csv.writer(cf)
+        writer.writerow(['networkName', 'name', 'serial', 'band', 'channel', 'width', 'power',
+                         'cochannel', 'overlapping', 'bandMedianPower', 'powerAnomaly'])
+        order = np.lexsort((name, band, network))
+        power = np.where(np.isnan(power), None, power)
+        median = np.where(np.isnan(median), None, median)
+        writer.writerows(zip(*(column[order].tolist() for column in (
+            network, name, serial, band, channel, width, power, cochannel, overlapping, median, anomaly))))
+
+
 async def aiomain():
     async with meraki.aio.AsyncDashboardAPI(
         api_key=os.getenv("APIKEY"),
@@ -135,19 +517,43 @@ async def aiomain():
 
         devices = await aGetOrgDevices(aiodash, org_id, productTypes="wireless")
         
+        bulk_status = {}
+        if bulk:
+            try:
+                bulk_status = await aGetOrgSsidStatuses(aiodash, org_id)
+            except meraki.APIError as e:
+                print(f"{YELLOW}Org-level SSID status unavailable ({e.status}), using per-device calls{ENDC}")
+
         appliance_details = {}
         tasks = []
         for device in devices:
             if device["serial"] not in appliance_details:
                 appliance_details[device["serial"]] = {}
 
-            tasks.append(aGetWirelessStatus(aiodash, device["serial"]))
             appliance_details[device["serial"]]["detail"] = device
+            if device["serial"] in bulk_status:
+                appliance_details[device["serial"]]["status"] = bulk_status[device["serial"]]
+            else:
+                tasks.append(aGetWirelessStatus(aiodash, device["serial"]))
+
+        if bulk:
+            print(f"{len(devices) - len(tasks)} APs from org-level status, {len(tasks)} per-device calls")
 
         for task in asyncio.as_completed(tasks):
             serial, result = await task
             appliance_details[serial]["status"] = result
 
+        if args.index:
+            con = index_open(args.db)
+            index_devices(con, appliance_details, net_map)
+            con.close()
+
+        if args.diff:
+            diff(appliance_details, net_map, org_id)
+
+        if args.rf:
+            rfAnalysis(appliance_details, net_map)
+
         if args.nocsv: # csv is the only output currently, no real need for this
             pass
         else:
@@ -162,6 +568,16 @@ if __name__ == "__main__":
     parser.add_argument("-i", type=str, help="Organization ID for operation")
     parser.add_argument("-n", type=str, help="Network name for operation")
     parser.add_argument("--all", action="store_true", help="Include unconfigured SSIDs")
+    parser.add_argument("--bulk", action="store_true",
+                        help="Use the org-level SSID status endpoint, per-device calls only for APs it misses")
+    parser.add_argument("--index", action="store_true", help="Update the local BSSID index")
+    parser.add_argument("--lookup", type=str, metavar="FILE",
+                        help="Resolve BSSIDs (one per line, - for stdin) from the local index, no API calls")
+    parser.add_argument("--db", type=str, default="index/bssid.db", help="BSSID index path")
+    parser.add_argument("--diff", action="store_true",
+                        help="Report BSSs added, removed or changed since the previous --diff run")
+    parser.add_argument("--rf", action="store_true",
+                        help="Analyse the channel plan: co-channel/overlap counts, channel usage, power outliers")
     parser.add_argument("--nocsv", action="store_true", help="Output CSV to file")
     parser.add_argument("--log", action="store_true", help="Log to file")
     parser.add_argument("-v", action="store_true", help="verbose")
@@ -171,6 +587,11 @@ if __name__ == "__main__":
     logging.getLogger(__name__)
     logger = logging.getLogger(__name__)
 
+    if args.lookup:
+        lookup(args.lookup)
+        print(f"\nScript complete, total runtime {datetime.now() - start_time}")
+        sys.exit()
+
     if args.o and args.i:
         print(f"{RED}Specify either -o or -i, not both{ENDC}")
         sys.exit()
@@ -194,6 +615,11 @@ if __name__ == "__main__":
     else:
         unconfigured_ssid = False
 
+    if args.bulk:
+        bulk = True
+    else:
+        bulk = False
+
     if args.v or args.d:
         logger.setLevel(logging.DEBUG)
 
@@ -1,14 +1,34 @@
 #!/usr/bin/env python
 import asyncio
+import csv
+import gzip
+import heapq
+import json
 import os
 import logging
 import sys
 import meraki
 import meraki.aio
+import numpy as np
 
 from argparse import ArgumentParser
 from collections import OrderedDict
-from datetime import datetime
+from datetime import datetime, timezone
+from itertools import chain
+from operator import itemgetter
+
+BANDS = ['2.4', '5', '6']
+MAX_LOOKBACK_DAYS = 180             # oldest t0 the connection stats endpoint accepts
+LOOKBACK_MARGIN = 60 * 60           # keep a clamped t0 this far inside the endpoint's limit
+SLICE_SECONDS = 7 * 24 * 60 * 60    # longest t0..t1 window per call
+SLICE_CONCURRENCY = 10              # in-flight calls, the per-org budget is 10 req/s
+FAST_MAX_LOOKBACK_DAYS = 90                 # oldest t0 of the org-level per-client endpoint
+FAST_SLICE_SECONDS = 90 * 24 * 60 * 60      # longest window of the org-level per-client endpoint
+STATSCACHE = "cache/connection_stats"
+STEPS = ['assoc', 'auth', 'dhcp', 'dns']     # failure counters, 'success' counts good connections
+STATS_MIN_ATTEMPTS = 20                      # networks with fewer attempts are left out of the worst list
+CACHE_SLICE_SECONDS = 24 * 60 * 60  # cached windows sit on a UTC day grid so they repeat across runs
+CACHE_SETTLE_SECONDS = 60 * 60      # a window is immutable once it closed at least this long ago
 
 BOLD = '\033[1m'
 ENDC = '\033[0m'
@@ -25,6 +45,104 @@ def daysToSeconds(num):
     return num * 24 * 60 * 60 
 
 
+def timeSlices(seconds, now=None, size=SLICE_SECONDS):
+    ''' splits the lookback ending now into (t0, t1) epoch windows no longer
+        than size, oldest first
+    '''
+    t1 = int(now or datetime.now(timezone.utc).timestamp())
+    start = t1 - seconds
+    slices = []
+    while t1 > start:
+        t0 = max(start, t1 - size)
+        slices.insert(0, (t0, t1))
+        t1 = t0
+    return slices
+
+
+def cacheSlices(seconds, now=None):
+    ''' (t0, t1) windows covering exactly the lookback ending now, oldest
+        first: the partial day from the start of the lookback to the next UTC
+        midnight, the whole UTC days after it, then today so far; only the
+        whole days can ever be cached
+    '''
+    now = int(now or datetime.now(timezone.utc).timestamp())
+    today = now - now % CACHE_SLICE_SECONDS
+    start = now - seconds
+    t0 = start - start % CACHE_SLICE_SECONDS
+    slices = []
+    if t0 < start:
+        t0 += CACHE_SLICE_SECONDS
+        slices.append((start, min(t0, now)))
+    while t0 < today:
+        slices.append((t0, t0 + CACHE_SLICE_SECONDS))
+        t0 += CACHE_SLICE_SECONDS
+    if today < now and today >= start:
+        slices.append((today, now))
+    return slices
+
+
+def cachePath(nid, band, t0, t1):
+    return os.path.join(STATSCACHE, nid, band, f'{t0}-{t1}.json.gz')
+
+
+def cacheLoad(nid, band, t0, t1):
+    path = cachePath(nid, band, t0, t1)
+    if not os.path.exists(path):
+        return None
+    with gzip.open(path, 'rt') as cf:
+        return json.load(cf)
+
+
+def cacheStore(nid, band, t0, t1, result):
+    ''' writes a closed window once; the .partial rename keeps a killed run
+        from leaving a truncated entry behind
+    '''
+    path = cachePath(nid, band, t0, t1)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with gzip.open(f'{path}.partial', 'wt') as cf:
+        json.dump(result, cf, separators=(',', ':'))
+    os.replace(f'{path}.partial', path)
+
+
+def cachePrune(now=None):
+    ''' drops windows older than the longest lookback the API allows '''
+    oldest = int(now or datetime.now(timezone.utc).timestamp()) - daysToSeconds(MAX_LOOKBACK_DAYS)
+    removed = 0
+    for root, _, files in os.walk(STATSCACHE):
+        for f in files:
+            if f.endswith('.json.gz') and int(f.split('-')[1].split('.')[0]) < oldest:
+                os.remove(os.path.join(root, f))
+                removed += 1
+    if removed:
+        logger.info(f"pruned {removed} expired cache entries")
+
+
+def clampT0(t0, max_seconds):
+    ''' moves t0 inside the endpoint's lookback limit as of now, queued calls
+        can go out long after the slices were planned
+    '''
+    oldest = int(datetime.now(timezone.utc).timestamp()) - max_seconds + LOOKBACK_MARGIN
+    return max(t0, oldest)
+
+
+def isoTime(epoch):
+    return datetime.fromtimestamp(epoch, timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def mergeClientStats(merged, result):
+    ''' folds one slice of per-client connection stats into {mac: stats},
+        summing the counters of clients seen in more than one slice
+    '''
+    for client in result:
+        mac = client['mac'].lower()
+        stats = client.get('connectionStats') or {}
+        if mac in merged:
+            for k, v in stats.items():
+                merged[mac][k] = merged[mac].get(k, 0) + v
+        else:
+            merged[mac] = dict(stats)
+
+
 async def aGetOrgs(aiodash, org_name=None, org_id=None):
     if org_id:
         result = await aiodash.organizations.getOrganization(org_id)
@@ -49,14 +167,242 @@ async def aGetNetworks(aiodash, org_id):
     return result
 
 
+def statsArrays(statistics):
+    ''' flattens {nid: {band: {mac: connectionStats}}} into columnar arrays:
+        network index, band index, per-step failures (n x 4) and successes
+    '''
+    nids = list(statistics)
+    getter = itemgetter(*STEPS, 'success')
+    sizes, net_idx, band_idx, blocks = [], [], [], []
+    for n, nid in enumerate(nids):
+        for b, band in enumerate(BANDS):
+            clients = statistics[nid].get(band) or {}
+            if not clients:
+                continue
+            sizes.append(len(clients))
+            net_idx.append(n)
+            band_idx.append(b)
+            blocks.append(map(getter, clients.values()))
+
+    total = sum(sizes)
+    counters = np.fromiter(chain.from_iterable(chain.from_iterable(blocks)), dtype=np.int64,
+                           count=total * (len(STEPS) + 1)).reshape(total, len(STEPS) + 1)
+    return (nids, np.repeat(net_idx, sizes).astype(np.int64), np.repeat(band_idx, sizes).astype(np.int64),
+            counters[:, :-1], counters[:, -1])
+
+
+def topN(values, top):
+    ''' (value, index) of the largest values, largest first; a partition picks
+        the candidates so only they go through the heap
+    '''
+    if len(values) > top:
+        threshold = np.partition(values, len(values) - top)[len(values) - top]
+        candidates = np.flatnonzero(values >= threshold)
+    else:
+        candidates = np.arange(len(values))
+    return heapq.nlargest(top, zip(values[candidates].tolist(), candidates.tolist()))
+
+
+def clientMac(statistics, nids, net, band, i):
+    ''' mac of client row i, rows of a (network, band) block are contiguous
+        and in dict order
+    '''
+    block = np.flatnonzero((net == net[i]) & (band == band[i]))
+    return list(statistics[nids[net[i]]][BANDS[band[i]]])[i - block[0]]
+
+
+def connectionSummary(statistics, eligible_networks, top):
+    ''' failure rates per network and band, org-wide failure percentiles per
+        band and the worst clients and networks
+    '''
+    nids, net, band, steps, success = statsArrays(statistics)
+    if not len(net):
+        print("No client connection stats in the timespan")
+        return
+
+    failures = steps.sum(axis=1)
+    attempts = failures + success
+    groups = len(nids) * len(BANDS)
+    key = net * len(BANDS) + band
+
+    g_clients = np.bincount(key, minlength=groups)
+    g_failures = np.bincount(key, weights=failures, minlength=groups)
+    g_attempts = np.bincount(key, weights=attempts, minlength=groups)
+    g_steps = np.stack([np.bincount(key, weights=steps[:, i], minlength=groups) for i in range(len(STEPS))], axis=1)
+
+    print(f"{BOLD}{'Band':>6} {'Clients':>9} {'Attempts':>10} {'Fail%':>6} {'p50':>5} {'p95':>5} {'p99':>5}  "
+          f"{'  '.join(f'{s:>5}' for s in STEPS)}{ENDC}")
+    for b, name in enumerate(BANDS):
+        members = band == b
+        if not members.any():
+            continue
+        p50, p95, p99 = np.percentile(failures[members], [50, 95, 99])
+        f, a = failures[members].sum(), attempts[members].sum()
+        by_step = steps[members].sum(axis=0)
+        print(f"{name + 'GHz':>6} {members.sum():>9} {a:>10} {100 * f / max(a, 1):>6.1f} {p50:>5.0f} {p95:>5.0f} {p99:>5.0f}  "
+              f"{'  '.join(f'{v:>5}' for v in by_step)}")
+
+    # worst clients by failure count, the heap keeps only the top entries
+    worst = topN(failures, top)
+    print(f"\n{BOLD}Top {top} clients by failed connections{ENDC}")
+    for count, i in worst:
+        if not count:
+            break
+        detail = ', '.join(f'{s} {v}' for s, v in zip(STEPS, steps[i]) if v)
+        print(f"{clientMac(statistics, nids, net, band, i)}  {eligible_networks[nids[net[i]]]['name']} {BANDS[band[i]]}GHz: "
+              f"{RED}{count} failed{ENDC} ({detail}), {success[i]} ok")
+
+    # worst networks by failure rate over all bands
+    n_failures = g_failures.reshape(len(nids), len(BANDS)).sum(axis=1)
+    n_attempts = g_attempts.reshape(len(nids), len(BANDS)).sum(axis=1)
+    rate = np.divide(n_failures, n_attempts, out=np.zeros(len(nids)), where=n_attempts > 0)
+    eligible = np.flatnonzero(n_attempts >= STATS_MIN_ATTEMPTS)
+    worst = topN(rate[eligible], top)
+    print(f"\n{BOLD}Top {top} networks by failure rate (>= {STATS_MIN_ATTEMPTS} attempts){ENDC}")
+    for r, n in ((r, eligible[k]) for r, k in worst):
+        print(f"{eligible_networks[nids[n]]['name']}: {RED}{100 * r:.1f}%{ENDC} "
+              f"of {int(n_attempts[n])} attempts")
+    print()
+
+    logdir = "report"
+    if not os.path.exists(logdir):
+        print("Creating report directory")
+        os.makedirs(logdir)
+
+    csvfile = f"{logdir}/connection_stats_{datetime.now():%Y%m%d-%H%M%S}.csv"
+    print(f"Writing {csvfile}")
+    with open(csvfile, 'w', newline='') as cf:
+        writer = csv.writer(cf)
+        writer.writerow(['networkName', 'band', 'clients', 'attempts', 'failures', 'failureRate', *STEPS])
+        for g in np.flatnonzero(g_clients):
+            n, b = divmod(int(g), len(BANDS))
+            writer.writerow([eligible_networks[nids[n]]['name'], BANDS[b], g_clients[g], int(g_attempts[g]),
+                             int(g_failures[g]), round(g_failures[g] / max(g_attempts[g], 1), 4),
+                             *g_steps[g].astype(int).tolist()])
+
+
 async def aGetClientConnectionStats(aiodash, net, timespan=None, t0=None, t1=None, band=None):
-    result = await aiodash.wireless.getNetworkWirelessClientsConnectionStats(net['id'], 
-                                                                             band=band,
-                                                                             timespan=timespan)
+    if timespan:
+        result = await aiodash.wireless.getNetworkWirelessClientsConnectionStats(net['id'], 
+                                                                                 band=band,
+                                                                                 timespan=timespan)
+    else:
+        result = await aiodash.wireless.getNetworkWirelessClientsConnectionStats(net['id'],
+                                                                                 band=band,
+                                                                                 t0=isoTime(t0),
+                                                                                 t1=isoTime(t1))
     logger.debug(f"getNetworkWirelessClientsConnectionStats: {CYAN}{result}{ENDC}")
     return net['id'], band, result
 
 
+async def aGetSlice(aiodash, sem, net, band, t0, t1, closed=False):
+    ''' one (network, band, slice) call under the shared semaphore, returns
+        None for the result when the call fails; closed windows are served from
+        and written to the cache
+    '''
+    if closed:
+        result = cacheLoad(net['id'], band, t0, t1)
+        if result is not None:
+            return net['id'], band, result, True
+
+    async with sem:
+        # a clamped window is shorter than its cache key, so it is not stored
+        start = clampT0(t0, daysToSeconds(MAX_LOOKBACK_DAYS))
+        if start >= t1:
+            # the whole window is past the lookback limit
+            return net['id'], band, [], False
+        try:
+            _, _, result = await aGetClientConnectionStats(aiodash, net, t0=start, t1=t1, band=band)
+        except meraki.APIError as e:
+            logger.error(f"{net['name']} {band}GHz {isoTime(start)}: {RED}{e}{ENDC}")
+            return net['id'], band, None, False
+
+    if closed and start == t0:
+        cacheStore(net['id'], band, t0, t1, result)
+    return net['id'], band, result, False
+
+
+async def aGetOrgBandClients(aiodash, org_id, band, t0, t1, networkIds=None):
+    ''' every wireless client seen on a band across the org, paged org-wide;
+        only the network and client mac of each row are used
+    '''
+    kwargs = {'networkIds': networkIds} if networkIds else {}
+    t0 = clampT0(t0, daysToSeconds(FAST_MAX_LOOKBACK_DAYS))
+    result = await aiodash.wireless.getOrganizationWirelessDevicesPacketLossByClient(org_id,
+                                                                                     total_pages='all',
+                                                                                     perPage=1000,
+                                                                                     bands=[band],
+                                                                                     t0=isoTime(t0),
+                                                                                     t1=isoTime(t1),
+                                                                                     **kwargs)
+    logger.debug(f"getOrganizationWirelessDevicesPacketLossByClient: {CYAN}{len(result)} clients{ENDC}")
+    return band, result
+
+
+async def aioconnstats(aiodash, eligible_networks):
+    ''' per-client connection stats, one call per (network, band, slice) '''
+    statistics = {} 
+    tasks = []
+    sem = asyncio.Semaphore(SLICE_CONCURRENCY)
+    if args.cache:
+        cachePrune()
+        slices = cacheSlices(timespan)
+        settled = datetime.now(timezone.utc).timestamp() - CACHE_SETTLE_SECONDS
+    else:
+        slices = timeSlices(timespan)
+        settled = 0
+
+    for en in eligible_networks:
+        statistics[en] = {band: {} for band in BANDS}
+        for band in BANDS:
+            for t0, t1 in slices:
+                closed = t1 <= settled and t0 % CACHE_SLICE_SECONDS == 0 and t1 - t0 == CACHE_SLICE_SECONDS
+                tasks.append(aGetSlice(aiodash, sem, eligible_networks[en], band, t0, t1, closed=closed))
+
+    print(f"{len(tasks)} slices: {len(eligible_networks)} networks x {len(BANDS)} bands x {len(slices)} slices")
+
+    failed = 0
+    cached = 0
+    for task in asyncio.as_completed(tasks):
+        nid, band, res, hit = await task
+        cached += hit
+        if res is None:
+            failed += 1
+        else:
+            mergeClientStats(statistics[nid][band], res)
+
+    if args.cache:
+        print(f"{cached} slices from cache, {len(tasks) - cached} fetched\n")
+    return statistics, failed
+
+
+async def aiofastcounts(aiodash, org_id, eligible_networks):
+    ''' per-network, per-band client MACs from one org-wide paged call per
+        band instead of 3 calls per network
+    '''
+    statistics = {en: {band: set() for band in BANDS} for en in eligible_networks}
+    networkIds = list(eligible_networks) if net_name else None
+    slices = timeSlices(timespan, size=FAST_SLICE_SECONDS)
+    tasks = [aGetOrgBandClients(aiodash, org_id, band, t0, t1, networkIds) for band in BANDS for t0, t1 in slices]
+
+    print(f"{len(tasks)} org-wide paged calls: {len(BANDS)} bands x {len(slices)} windows")
+
+    failed = 0
+    for task in asyncio.as_completed(tasks):
+        try:
+            band, res = await task
+        except meraki.APIError as e:
+            logger.error(f"getOrganizationWirelessDevicesPacketLossByClient: {RED}{e}{ENDC}")
+            failed += 1
+            continue
+        for client in res:
+            nid = client['network']['id']
+            if nid in statistics:
+                statistics[nid][band].add(client['client']['mac'].lower())
+    print()
+    return statistics, failed
+
+
 # async def aGetNetworkClients(aiodash, net, perPage=1000, timespan=None, t0=None, recentDeviceConnections=None):
 #     result = await aiodash.networks.getNetworkClients(net['id'], 
 #                                                       timespan=timespan,
@@ -102,29 +448,32 @@ async def aiomain():
             elif 'wireless' in net['productTypes']:
                 eligible_networks[net['id']] = net 
                 
-        statistics = {} 
-        tasks = []
-
-        for en in eligible_networks:
-            tasks.append(aGetClientConnectionStats(aiodash, eligible_networks[en], timespan=timespan, band='2.4'))
-            tasks.append(aGetClientConnectionStats(aiodash, eligible_networks[en], timespan=timespan, band='5'))
-            tasks.append(aGetClientConnectionStats(aiodash, eligible_networks[en], timespan=timespan, band='6'))
-
-        for task in asyncio.as_completed(tasks):
-            nid, band, res = await task
-            try:
-                statistics[nid]
-            except:
-                statistics[nid] = {}
-            statistics[nid][band] = res
-        
+        if args.fast:
+            statistics, failed = await aiofastcounts(aiodash, org_id, eligible_networks)
+        else:
+            statistics, failed = await aioconnstats(aiodash, eligible_networks)
+
+        org_clients = {band: set() for band in BANDS}
         for stat in statistics:
             print(f"Network: {eligible_networks[stat]['name']}")
             print("Clients by band")
             for band in sorted(statistics[stat]):
                 print(f"{band:>3}GHz: {len(statistics[stat][band])}")
+                org_clients[band].update(statistics[stat][band])
             print()       
 
+        if len(statistics) > 1:
+            print(f"{BOLD}Organization{ENDC} (unique clients over {timespan // 86400} days)")
+            for band in BANDS:
+                print(f"{band:>3}GHz: {len(org_clients[band])}")
+
+        if args.stats:
+            print()
+            connectionSummary(statistics, eligible_networks, args.top)
+
+        if failed:
+            print(f"\n{RED}{failed} calls failed, counts are incomplete{ENDC}")
+
 
 if __name__ == '__main__':
     start_time = datetime.now()
@@ -137,7 +486,15 @@ if __name__ == '__main__':
     parser.add_argument('-n', type = str,
                         help = 'Network name for operation')
     parser.add_argument('-t', type = int,
-                        help = 'Timespan (days) for operation, up to 7 (Default: 1)')
+                        help = f'Timespan (days) for operation, up to {MAX_LOOKBACK_DAYS} (Default: 1)')
+    parser.add_argument("--fast", action = "store_true",
+                        help = 'Count clients with org-wide paged calls, no per-network connection stats')
+    parser.add_argument("--stats", action = "store_true",
+                        help = 'Summarize connection failures per band, worst clients and networks')
+    parser.add_argument("--top", type = int, default = 10,
+                        help = 'Entries in the --stats worst lists (Default: 10)')
+    parser.add_argument("--cache", action = "store_true",
+                        help = f'Cache closed day windows under {STATSCACHE}, only refetch the open one')
     parser.add_argument("--log", action = "store_true",
                         help = 'Log to file')
     parser.add_argument("-v", action = "store_true",
@@ -186,10 +543,16 @@ if __name__ == '__main__':
         logger.addHandler(handler_console)
         logger.propagate = False
 
+    if args.stats and args.fast:
+        print(f"{RED}--stats needs per-client connection stats, it can't be used with --fast{ENDC}")
+        sys.exit()
+
     if args.t:
-        # might implement time slices later to use a longer lookback (up to 180 days)
-        if args.t > 7:
-            print("No more than 7 days lookback")
+        if args.t > MAX_LOOKBACK_DAYS:
+            print(f"No more than {MAX_LOOKBACK_DAYS} days lookback")
+            sys.exit()
+        elif args.fast and args.t > FAST_MAX_LOOKBACK_DAYS:
+            print(f"No more than {FAST_MAX_LOOKBACK_DAYS} days lookback with --fast")
             sys.exit()
         else:
             timespan = daysToSeconds(args.t)
@@ -1,7 +1,11 @@
 #!/usr/bin/env python
+import asyncio
+import csv
 import os
+import sys
 
 import meraki
+import meraki.aio
 
 from argparse import ArgumentParser
 from datetime import datetime
@@ -17,6 +21,152 @@ PURPLE = '\033[35m'
 LGRAY = '\033[97m'
 DGRAY = '\033[90m'
 
+def readMapping(path):
+    ''' reads rows of network or tag, ssid, sgt from a CSV file with a
+        network,tag,ssid,sgt header; a row targets one network by name or
+        every network carrying the tag
+    '''
+    with open(path, 'r', newline='') as mf:
+        rows = list(csv.DictReader(mf))
+
+    mapping = []
+    errors = []
+    for line, row in enumerate(rows, start=2):
+        row = {k: (row.get(k) or '').strip() for k in ('network', 'tag', 'ssid', 'sgt')}
+        if bool(row['network']) == bool(row['tag']):
+            errors.append(f'line {line}: set exactly one of network or tag')
+        elif not row['ssid']:
+            errors.append(f'line {line}: missing ssid')
+        elif not row['sgt'].isdigit():
+            errors.append(f'line {line}: sgt must be a number, got "{row["sgt"]}"')
+        else:
+            row['sgt'] = int(row['sgt'])
+            mapping.append(row)
+
+    if errors:
+        print(f'{RED}Invalid mapping file {path}:{ENDC}')
+        for e in errors:
+            print(f'  {e}')
+        sys.exit()
+    return mapping
+
+
+def resolveTargets(mapping, networks, sgt_groups):
+    ''' expands the mapping to {net_id: {ssid name: sgt}} over wireless networks,
+        exits on unknown networks/SGTs or one SSID mapped to two SGTs
+    '''
+    by_name = {n['name']: n for n in networks if 'wireless' in n['productTypes']}
+    by_tag = {}
+    for n in by_name.values():
+        for tag in n['tags']:
+            by_tag.setdefault(tag, []).append(n)
+
+    targets = {}
+    errors = []
+    for row in mapping:
+        if row['sgt'] not in sgt_groups:
+            errors.append(f'SGT {row["sgt"]} has no adaptive policy group')
+            continue
+        if row['network']:
+            nets = [by_name[row['network']]] if row['network'] in by_name else []
+            if not nets:
+                errors.append(f'no wireless network named {row["network"]}')
+        else:
+            nets = by_tag.get(row['tag'], [])
+            if not nets:
+                print(f'{YELLOW}No wireless networks tagged {row["tag"]}{ENDC}')
+        for n in nets:
+            current = targets.setdefault(n['id'], {}).setdefault(row['ssid'], row['sgt'])
+            if current != row['sgt']:
+                errors.append(f'{n["name"]} / {row["ssid"]} mapped to SGT {current} and {row["sgt"]}')
+
+    if errors:
+        print(f'{RED}Mapping does not resolve:{ENDC}')
+        for e in sorted(set(errors)):
+            print(f'  {e}')
+        sys.exit()
+    return targets
+
+
+async def aAssignNetwork(aiodash, sem, network, wanted, sgt_groups):
+    ''' reads the network's SSIDs once and sends only adaptivePolicyGroupId for
+        the SSIDs that are on another group, returns [(ssid, sgt, status)]
+    '''
+    results = []
+    async with sem:
+        try:
+            ssids = await aiodash.wireless.getNetworkWirelessSsids(network['id'])
+        except meraki.APIError as e:
+            print(f'Meraki API error on {network["name"]}: {e}')
+            return network, [(name, sgt, 'failed') for name, sgt in wanted.items()]
+
+        by_name = {ssid['name']: ssid for ssid in ssids}
+        for name, sgt in wanted.items():
+            ssid = by_name.get(name)
+            if not ssid:
+                results.append((name, sgt, 'missing'))
+            elif str(ssid.get('adaptivePolicyGroupId')) == str(sgt_groups[sgt]):
+                results.append((name, sgt, 'unchanged'))
+            elif check_only:
+                results.append((name, sgt, 'would change'))
+            else:
+                try:
+                    await aiodash.wireless.updateNetworkWirelessSsid(network['id'], ssid['number'],
+                                                                     adaptivePolicyGroupId=sgt_groups[sgt])
+                    results.append((name, sgt, 'changed'))
+                except meraki.APIError as e:
+                    print(f'Meraki API error on {network["name"]} / {name}: {e}')
+                    results.append((name, sgt, 'failed'))
+    return network, results
+
+
+async def aiobulk(mapping):
+    async with meraki.aio.AsyncDashboardAPI(
+        api_key=os.getenv('APIKEY'),
+        base_url='https://api.meraki.com/api/v1/',
+        output_log=False,
+        log_file_prefix=os.path.basename(__file__)[:-3],
+        log_path='',
+        print_console=False,
+        inherit_logging_config=True,
+        maximum_concurrent_requests=limit,
+        maximum_retries=100,
+        wait_on_rate_limit=True,
+    ) as aiodash:
+        if not org_id:
+            orgs = await aiodash.organizations.getOrganizations()
+            match = [org for org in orgs if org['name'] == org_name and org['api']['enabled']]
+            if not match:
+                print(f'{RED}No API enabled organization named {org_name}{ENDC}')
+                return
+            oid = match[0]['id']
+        else:
+            oid = org_id
+
+        networks = await aiodash.organizations.getOrganizationNetworks(oid, perPage=1000, total_pages='all')
+        adp_groups = await aiodash.organizations.getOrganizationAdaptivePolicyGroups(oid)
+        sgt_groups = {int(group['sgt']): group['groupId'] for group in adp_groups}
+
+        targets = resolveTargets(mapping, networks, sgt_groups)
+        net_map = {n['id']: n for n in networks}
+        print(f'{len(mapping)} mapping rows resolve to {sum(len(t) for t in targets.values())} SSIDs '
+              f'in {len(targets)} networks')
+
+        sem = asyncio.Semaphore(limit)
+        tasks = [aAssignNetwork(aiodash, sem, net_map[nid], wanted, sgt_groups) for nid, wanted in targets.items()]
+
+        counts = {}
+        for task in asyncio.as_completed(tasks):
+            network, results = await task
+            for name, sgt, status in results:
+                counts[status] = counts.get(status, 0) + 1
+                if status != 'unchanged':
+                    color = RED if status in ('failed', 'missing') else GREEN
+                    print(f'{network["name"]} / {name}: SGT {sgt} {color}{status}{ENDC}')
+
+        print(f'\n{BOLD}' + ', '.join(f'{n} {status}' for status, n in sorted(counts.items())) + f'{ENDC}')
+
+
 def main():
     test_org = 112233 # your Org ID
     test_network = "RANDOMNETWORK" # test Network
@@ -96,6 +246,34 @@ def main():
 
 if __name__ == '__main__':
     start_time = datetime.now()
-    main()
+    parser = ArgumentParser(description = 'Select options.')
+
+    parser.add_argument('-o', type = str,
+                        help = 'Organization name for operation')
+    parser.add_argument('-i', type = str,
+                        help = 'Organization ID for operation')
+    parser.add_argument('-f', type = str,
+                        help = 'Bulk mapping CSV with network,tag,ssid,sgt columns')
+    parser.add_argument('-k', action = 'store_true',
+                        help = 'Check only, report the SSIDs that would change')
+    parser.add_argument('-l', type = int,
+                        default=10,
+                        help = 'Concurrent networks with -f (Default: 10)')
+    args = parser.parse_args()
+
+    if args.f:
+        if bool(args.o) == bool(args.i):
+            print(f'{RED}Specify the organization with either -o or -i{ENDC}')
+            sys.exit()
+        if args.l < 1:
+            print('Concurrency (-l) must be at least 1')
+            sys.exit()
+        org_name = args.o
+        org_id = args.i
+        check_only = args.k
+        limit = args.l
+        asyncio.run(aiobulk(readMapping(args.f)))
+    else:
+        main()
     end_time = datetime.now()
     print(f'\nScript complete, total runtime {end_time - start_time}')